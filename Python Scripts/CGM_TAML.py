@@ -2,149 +2,345 @@
 import cgmquantify_stuart as cgm
 import pandas as pd
 import numpy as np
-import random
+from profiling import NULL_PROFILER
 
-def quantify_glycemic_features(df):
-    df = df.reset_index(drop=True)
-    features = {}
-    
-    # cgm.summary(df) returns 6 elements: 'mean', 'median', 'min', 'max', 'fq', 'tq'
-    summary_stats = cgm.summary(df)
-    feature_names = ['mean', 'median', 'min', 'max', 'fq', 'tq']
-    features.update(dict(zip(feature_names, summary_stats)))
+# Features reported by fixed_time_sliding_window_0oclock_1random_day
+RANDOM_DAY_FEATURE_NAMES = [
+    "mean", "median", "min", "max", "fq", "tq",
+    "interdaysd", "interdaycv", "TOR", "TIR", "MGE", "MGN",
+    "J_index", "LBGI", "HBGI", "ADRR", "TA140", "TA200"
+]
+
+def quantify_glycemic_features(df, profiler=None, features=None, cache=None):
+    # Single pass over the window's glucose array, see cgm.glycemic_features.
+    # features selects registered feature names (default: cgm.GLYCEMIC_FEATURE_NAMES).
+    # Pass a feature_cache.FeatureCache as cache to reuse the values of a window seen before.
+    profiler = profiler or NULL_PROFILER
+    if cache is not None:
+        feature_names = list(cgm.GLYCEMIC_FEATURE_NAMES if features is None else features)
+        glucose = df['Glucose'].to_numpy(dtype=float)[None, :]
+        row = _cached_features_batch(glucose, None, profiler, feature_names, cache)[0]
+        return {name: int(value) if cgm.FEATURES[name].integer else value for name, value in zip(feature_names, row)}
+    with profiler.stage('featurization'):
+        return cgm.glycemic_features(df['Glucose'].to_numpy(dtype=float), profiler=profiler, features=features)
+
+def _cached_features_batch(glucose, lengths, profiler, feature_names, cache):
+    # Featurize only the windows missing from the cache; counters: cache_hits, cache_misses
+    with profiler.stage('feature_cache'):
+        keys = cache.window_keys(glucose, lengths, features=feature_names)
+        values, found = cache.get_many(keys, len(feature_names))
+    missing = np.flatnonzero(~found)
+    if len(missing):
+        with profiler.stage('featurization'):
+            values[missing] = cgm.glycemic_features_batch(
+                glucose[missing], lengths=None if lengths is None else np.asarray(lengths)[missing],
+                profiler=profiler, features=feature_names
+            )
+        with profiler.stage('feature_cache'):
+            cache.put_many([keys[position] for position in missing], values[missing])
+    if profiler.enabled:
+        profiler.count('cache_hits', len(keys) - len(missing))
+        profiler.count('cache_misses', len(missing))
+    return values
+
+def quantify_glycemic_features_batch(glucose, window_ids, lengths=None, profiler=None, features=None, cache=None):
+    # Feature table for a (n_windows x n_slots) matrix of 5-minute glucose values,
+    # one row per window id, see cgm.glycemic_features_batch.
+    # With a feature_cache.FeatureCache, only windows not found in it are featurized.
+    profiler = profiler or NULL_PROFILER
+    feature_names = list(cgm.GLYCEMIC_FEATURE_NAMES if features is None else features)
+    if cache is not None:
+        values = _cached_features_batch(glucose, lengths, profiler, feature_names, cache)
+    else:
+        with profiler.stage('featurization'):
+            values = cgm.glycemic_features_batch(glucose, lengths=lengths, profiler=profiler, features=feature_names)
+    return _feature_frame(values, window_ids, feature_names)
+
+def _feature_frame(values, window_ids, feature_names):
+    # Feature table from a (n_windows x n_features) value matrix, count features as integers
+    feature_table = pd.DataFrame(values, columns=feature_names)
+    integer_features = [name for name in feature_names if cgm.FEATURES[name].integer]
+    feature_table[integer_features] = feature_table[integer_features].astype(int)
+    feature_table.insert(0, 'id', np.asarray(window_ids, dtype=object))
+    return feature_table
+
+def midnight_anchor_index(df, one_per_midnight=False):
+    # Positions of readings between 23:57:30 and 00:02:30 in a time-sorted frame.
+    # With one_per_midnight only the reading closest to each calendar midnight is kept.
+    converted_time = (df.Time.dt.hour * 3600 + df.Time.dt.minute * 60 + df.Time.dt.second).to_numpy()
+    condition = (converted_time >= 23 * 3600 + 57 * 60 + 30) | (converted_time < 0 * 3600 + 2 * 60 + 30)
+    converted_time_index = np.flatnonzero(condition)
     
-    # Add other features
-    features['interdaysd'] = cgm.interdaysd(df)
-    features['interdaycv'] = cgm.interdaycv(df)
-    features['TOR'] = cgm.TOR(df)
-    features['TIR'] = cgm.TIR(df)
-    features['MGE'] = cgm.MGE(df)
-    features['MGN'] = cgm.MGN(df)
-    features['J_index'] = cgm.J_index(df)
-    features['LBGI'] = cgm.LBGI(df)
-    features['HBGI'] = cgm.HBGI(df)
-    features['ADRR'] = cgm.DRR(df)
-    features['TA140'] = cgm.TAT(df, thres=140)
-    features['TA200'] = cgm.TAT(df, thres=200)
-    features['TIR_70_180'] = cgm.TIR_lo_hi(df)
-    features['TA180'] = cgm.TAT(df, thres=180)
-    features['TA250'] = cgm.TAT(df, thres=250)
-    features['TB70'] = cgm.TBT(df, thres=70)
-    features['TB54'] = cgm.TBT(df, thres=54)
-    features['TITR'] = cgm.TIR_lo_hi(df, up=140, dw=70)
-    features['GRI'] = cgm.GRI(df)
-    features['PA140'] = cgm.count_peaks(df, 140)
-    features['PA180'] = cgm.count_peaks(df, 180)
-    features['PA200'] = cgm.count_peaks(df, 200)
+    if one_per_midnight:
+        converted_time_index = closest_per_midnight(df, converted_time_index)
     
-    return features
+    return converted_time_index
+
+def closest_per_midnight(df, index):
+    # Of the anchor positions index, keep the one closest to each calendar midnight (the
+    # earliest on ties), in ascending order
+    if len(index) == 0:
+        return index
+    anchor_time = df.Time.iloc[index]
+    midnight = anchor_time.dt.round('D')
+    anchors = pd.DataFrame({
+        'index': index,
+        'midnight': midnight.to_numpy(),
+        'distance': (anchor_time - midnight).abs().to_numpy(),
+    })
+    anchors = anchors.sort_values(['midnight', 'distance', 'index']).drop_duplicates('midnight')
+    return np.sort(anchors['index'].to_numpy())
 
-def feature_extraction_fixed_hour_window_0oclock(df, id, hour=24):
+def regularize_glucose(df, sr=5, fill='none', max_gap=None):
+    # One pass per subject: readings of a time-sorted frame go onto a regular grid of
+    # sr-minute bins aligned to the epoch (as resample does), each bin holding the median
+    # of its readings. The grid spans every reading, NaN glucose included, so it starts at
+    # the first timestamp. Gaps are left as NaN (fill='none') or filled by 'linear' or
+    # quadratic 'spline' interpolation when at most max_gap minutes long (None: any
+    # length); only gaps between two observed bins are filled, never the ends.
+    # Returns the grid start (datetime64), the grid values and the observed-bin mask.
+    if fill not in ('none', 'linear', 'spline'):
+        raise ValueError(f"fill must be 'none', 'linear' or 'spline', not {fill!r}")
+    bin_ns = pd.Timedelta(minutes=sr).value
+    times = df.Time.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    if len(times) == 0:
+        return np.datetime64('NaT', 'ns'), np.empty(0), np.empty(0, dtype=bool)
+    glucose = df.Glucose.to_numpy(dtype=float)
+    all_bins = times // bin_ns
+    first = all_bins.min()
+    values = np.full(int(all_bins.max() - first) + 1, np.nan)
+
+    keep = ~np.isnan(glucose)
+    slot, glucose = all_bins[keep] - first, glucose[keep]
+    if np.all(slot[1:] > slot[:-1]):
+        # One reading per bin, the usual case for 5-minute sensors
+        values[slot] = glucose
+    else:
+        medians = pd.Series(glucose).groupby(slot).median()
+        values[medians.index.to_numpy()] = medians.to_numpy()
+    observed = ~np.isnan(values)
+
+    positions = np.flatnonzero(observed)
+    if fill != 'none' and len(positions) > 1:
+        missing = np.flatnonzero(~observed)
+        missing = missing[(missing > positions[0]) & (missing < positions[-1])]
+        # Length of the gap each missing bin belongs to, in minutes
+        right = np.searchsorted(positions, missing)
+        gap = (positions[right] - positions[right - 1] - 1)*sr
+        if max_gap is not None:
+            missing = missing[gap <= max_gap]
+        if len(missing) and fill == 'linear':
+            values[missing] = np.interp(missing, positions, values[positions])
+        elif len(missing) and len(positions) > 2:
+            # Imported here so scipy is only needed when spline filling is used
+            from scipy.interpolate import make_interp_spline
+            values[missing] = make_interp_spline(positions, values[positions], k=2)(missing)
+
+    start = np.datetime64(int(first*bin_ns), 'ns')
+    return start, values, observed
+
+def grid_windows(df, start_times, n_slots, fill='none', max_gap=None):
+    # Regularize a time-sorted subject once and gather the n_slots-bin windows starting at
+    # the bins of start_times from sliding views of the grid. Windows end at the last bin
+    # holding a reading (NaN glucose included), as resampling the window's readings would.
+    if len(start_times) == 0:
+        return np.empty((0, n_slots)), np.zeros(0, dtype=int)
+    grid_start, values, _ = regularize_glucose(df, fill=fill, max_gap=max_gap)
+    step = np.timedelta64(5, 'm')
+    read = np.zeros(len(values), dtype=bool)
+    read[(df.Time.to_numpy(dtype='datetime64[ns]') - grid_start) // step] = True
+
+    # Pad so that every window view fits inside the grid
+    values = np.concatenate([values, np.full(n_slots, np.nan)])
+    read = np.concatenate([read, np.zeros(n_slots, dtype=bool)])
+    offsets = (start_times - grid_start) // step
+    if len(offsets) and (offsets.min() < 0 or offsets.max() > len(values) - n_slots):
+        raise ValueError("window start outside the subject's readings")
+    glucose = np.lib.stride_tricks.sliding_window_view(values, n_slots)[offsets]
+    has_reading = np.lib.stride_tricks.sliding_window_view(read, n_slots)[offsets]
+    lengths = np.where(has_reading.any(axis=1), n_slots - np.argmax(has_reading[:, ::-1], axis=1), 0)
+    return glucose, lengths
+
+def daily_glucose_windows(df, id, hour=24, one_per_midnight=False, profiler=None, fill='none', max_gap=None):
+    # Each subject is regularized onto the 5-minute grid once (see regularize_glucose) and
+    # every window is a hour*12-slot view into that grid starting at its anchor's bin.
+    # Profiler stages: window_bounds, regularization; counters: rows_processed,
+    # candidate_windows, rejected_windows, windows
+    profiler = profiler or NULL_PROFILER
     df = df.sort_values(by='Time').reset_index(drop=True)
     window_size = pd.Timedelta(hours=hour)
+    n_slots = int(window_size / pd.Timedelta(minutes=5))
     
-    # Convert time to seconds
-    converted_time = [time.hour * 3600 + time.minute * 60 + time.second for time in df.Time.dt.time]
-    
-    # Start between 23:57:30 to 00:02:30
-    converted_time_index = [
-        index for index, time in enumerate(converted_time)
-        if time >= 23 * 3600 + 57 * 60 + 30 or time < 0 * 3600 + 2 * 60 + 30
-    ]
+    with profiler.stage('window_bounds'):
+        converted_time_index = midnight_anchor_index(df, one_per_midnight=one_per_midnight)
+        
+        # Window bounds by binary search on the sorted timestamps
+        times = df.Time.to_numpy()
+        start_times = times[converted_time_index]
+        window_starts = np.searchsorted(times, start_times, side='left')
+        window_ends = np.searchsorted(times, start_times + window_size.to_timedelta64(), side='left')
     
-    window_number = 0
     # Number of data points for 70% coverage with 5-minute intervals
     window_data_threshold = pd.Timedelta(hours=hour) / pd.Timedelta(minutes=5) * 0.70
+    accepted = np.flatnonzero(window_ends - window_starts > window_data_threshold)
     
-    feature_list = []
+    with profiler.stage('regularization'):
+        glucose, lengths = grid_windows(df, start_times[accepted], n_slots, fill=fill, max_gap=max_gap)
     
-    for start_time_index in converted_time_index:
-        window_number += 1
-        start_time = df.Time[start_time_index]
-        window_condition = (df.Time >= start_time) & (df.Time < start_time + window_size)
-        df_window = df[window_condition]
-        
-        if len(df_window) > window_data_threshold:
-            df_window = df_window.copy()
-            df_window.set_index('Time', inplace=True)
-            df_window.drop(columns=['ID'], inplace=True, errors='ignore')
-            df_window = df_window.resample('5min').median()
-            df_window.reset_index(inplace=True)
-            
-            features = quantify_glycemic_features(df_window.drop(columns=["Time"]))
-            features['id'] = f"{id}_win{window_number}"
-            feature_list.append(features)
+    if profiler.enabled:
+        profiler.count('rows_processed', len(df))
+        profiler.count('candidate_windows', len(window_starts))
+        profiler.count('rejected_windows', len(window_starts) - len(accepted))
+        profiler.count('windows', len(accepted))
     
-    # Convert list of feature dictionaries to DataFrame
-    feature_table = pd.DataFrame(feature_list)
+    window_ids = np.array([f"{id}_win{window_number + 1}" for window_number in accepted], dtype=object)
+    return window_ids, glucose, lengths.astype(int)
+
+def subject_interday_features(df, id, conga_hours=(1, 2, 4, 24)):
+    # Multi-day variability of one subject (MODD, CONGA-n, interday/intraday SD and CV)
+    # from its readings on a calendar-day x 5-minute-slot matrix, see cgm.interday_metrics
+    matrix, _ = cgm.day_slot_matrix(df['Time'], df['Glucose'])
+    features = cgm.interday_metrics(matrix, conga_hours=conga_hours)
+    return pd.DataFrame([{'id': id, **features}])
+
+def feature_extraction_fixed_hour_window_0oclock(df, id, hour=24, one_per_midnight=False, profiler=None,
+                                                 features=None, subject_features=False, fill='none', max_gap=None,
+                                                 cache=None):
+    # Windows of a subject are resampled onto one matrix and featurized in a single batch.
+    # Pass a profiling.Profiler to record time per stage and per feature, and a list of
+    # feature names to compute only those features and their intermediates.
+    # With subject_features, the subject's cgm.SUBJECT_FEATURE_NAMES are added to every window row.
+    # fill and max_gap select gap filling on the 5-minute grid, see regularize_glucose.
+    # Pass a feature_cache.FeatureCache as cache to featurize only windows it has not seen.
+    window_ids, glucose, lengths = daily_glucose_windows(
+        df, id, hour=hour, one_per_midnight=one_per_midnight, profiler=profiler, fill=fill, max_gap=max_gap
+    )
+    feature_table = quantify_glycemic_features_batch(glucose, window_ids, lengths, profiler=profiler,
+                                                     features=features, cache=cache)
     
     # Reorder columns to match desired feature names
-    feature_names = [
-        "id", "mean", "median", "min", "max", "fq", "tq",
-        "interdaysd", "interdaycv", "TOR", "TIR", "MGE", "MGN", "J_index",
-        "LBGI", "HBGI", "ADRR", "TA140", "TA200", "TIR_70_180", "TA180",
-        "TA250", "TB70", "TB54", "TITR", "GRI", "PA140", "PA180", "PA200"
-    ]
+    feature_names = ["id"] + list(cgm.GLYCEMIC_FEATURE_NAMES if features is None else features)
     feature_table = feature_table.reindex(columns=feature_names)
+
+    if subject_features:
+        profiler = profiler or NULL_PROFILER
+        with profiler.stage('subject_features'):
+            subject_table = subject_interday_features(df, id)
+        for name in cgm.SUBJECT_FEATURE_NAMES:
+            feature_table[name] = subject_table[name].iloc[0]
     
     return feature_table
 
 
-def fixed_time_sliding_window_0oclock_1random_day(df, id, hour=24):
-    df = df.sort_values(by='Time').reset_index(drop=True)
-    df['Day'] = df['Time'].dt.date
-    
-    window_size = pd.Timedelta(hours=hour)
+class QualifyingDays:
+    """
+    Index of one subject's qualifying days, for fast and reproducible day sampling.
 
-    # Convert time to seconds since midnight
-    converted_time = df['Time'].dt.hour * 3600 + df['Time'].dt.minute * 60 + df['Time'].dt.second
+    Midnight anchors and their window coverage are found once with a binary search on the
+    sorted timestamps, and each calendar midnight counts once: of its anchors whose window
+    has more readings than coverage of the 5-minute slots, the one closest to midnight is
+    kept. Qualifying windows are gathered from the subject's regularized grid. Each day is
+    featurized at most once, when feature_table or sample_features first needs it, and its
+    feature row is kept, so repeated (e.g. bootstrap) sampling only indexes stored rows.
 
-    # Find indices where time is between 23:57:30 and 00:02:30
-    condition = (converted_time >= 23 * 3600 + 57 * 60 + 30) | (converted_time < 2 * 60 + 30)
-    converted_time_index = df.index[condition].tolist()
+    Parameters:
+    - df: pandas DataFrame with Glucose and Time columns for one subject.
+    - id: the subject id.
+    - hour: int, the window length in hours.
+    - coverage: float, the fraction of 5-minute slots a window needs to qualify.
+    - features: list of str, registered feature names (default: cgm.GLYCEMIC_FEATURE_NAMES).
+    - fill, max_gap: gap filling on the grid, see regularize_glucose.
+    - cache: feature_cache.FeatureCache reused for windows featurized before (default: none).
+    """
 
-    # Number of data points for 95% coverage with 5-minute intervals
-    window_data_threshold = (pd.Timedelta(hours=hour) / pd.Timedelta(minutes=5)) * 0.95
+    def __init__(self, df, id, hour=24, coverage=0.95, features=None, fill='none', max_gap=None, cache=None):
+        df = df.sort_values(by='Time').reset_index(drop=True)
+        window_size = pd.Timedelta(hours=hour)
+        n_slots = int(window_size / pd.Timedelta(minutes=5))
 
-    # Shuffle the indices to pick a random day
-    random.shuffle(converted_time_index)
+        anchors = midnight_anchor_index(df)
+        times = df.Time.to_numpy()
+        window_ends = np.searchsorted(times, times[anchors] + window_size.to_timedelta64(), side='left')
+        qualifying = np.flatnonzero(window_ends - anchors > n_slots * coverage)
+        qualifying = np.searchsorted(anchors, closest_per_midnight(df, anchors[qualifying]))
 
-    feature_list = []
-    for start_time_index in converted_time_index:
-        start_time = df.loc[start_time_index, 'Time']
-        end_time = start_time + window_size
-        window_condition = (df['Time'] >= start_time) & (df['Time'] < end_time)
-        df_window = df[window_condition].copy()
+        self.id = id
+        self.features = list(cgm.GLYCEMIC_FEATURE_NAMES if features is None else features)
+        self.cache = cache
+        self.start_times = times[anchors[qualifying]]
+        self.window_ids = np.array([f"{id}_win{number + 1}" for number in qualifying], dtype=object)
+        self.glucose, self.lengths = grid_windows(df, self.start_times, n_slots, fill=fill, max_gap=max_gap)
+        # Feature rows of the days featurized so far
+        self._values = np.full((len(qualifying), len(self.features)), np.nan)
+        self._featurized = np.zeros(len(qualifying), dtype=bool)
 
-        if len(df_window) > window_data_threshold:
-            # Interpolate the 'Glucose' column
-            df_window['Glucose'] = df_window['Glucose'].interpolate(method='spline', order=2)
+    def __len__(self):
+        return len(self.window_ids)
 
-            # Quantify glycemic features
-            features = quantify_glycemic_features(df_window)
+    @property
+    def feature_table(self):
+        # Features of every qualifying day, the days not featurized yet in one batch
+        return self._feature_rows(np.arange(len(self)))
 
-            # Add 'id' to features
-            features['id'] = id
-            feature_list.append(features)
-            break  # Only process one window
+    def _feature_rows(self, days):
+        # Feature table of days, featurizing the days not seen before in one batch
+        new = np.unique(days[~self._featurized[days]])
+        if len(new):
+            feature_table = quantify_glycemic_features_batch(
+                self.glucose[new], self.window_ids[new], self.lengths[new], features=self.features, cache=self.cache
+            )
+            self._values[new] = feature_table[self.features].to_numpy(dtype=float)
+            self._featurized[new] = True
+        return _feature_frame(self._values[days], self.window_ids[days], self.features)
 
-    if feature_list:
-        feature_table = pd.DataFrame(feature_list)
-    else:
-        # If no window meets the threshold, return an empty DataFrame with the feature columns
-        feature_table = pd.DataFrame(columns=[
-            "id", "mean", "median", "min", "max", "fq", "tq",
-            "interdaysd", "interdaycv", "TOR", "TIR", "MGE", "MGN",
-            "J_index", "LBGI", "HBGI", "ADRR", "TA140", "TA200"
-        ])
-        feature_table['id'] = id
+    def sample(self, k=1, replace=False, rng=None):
+        """
+        Draw k qualifying days uniformly.
+
+        Parameters:
+        - k: int, the number of days.
+        - replace: bool, draw with replacement (e.g. for bootstrap resampling).
+        - rng: int seed or numpy Generator; None draws from fresh OS entropy.
+
+        Returns:
+        - days: numpy array of int positions into the qualifying days (fewer than k when
+          sampling without replacement from fewer days).
+        """
+        rng = np.random.default_rng(rng)
+        if not replace:
+            k = min(k, len(self))
+        if len(self) == 0:
+            return np.empty(0, dtype=int)
+        return rng.choice(len(self), size=k, replace=replace)
+
+    def sample_features(self, k=1, replace=False, rng=None):
+        """
+        Feature rows of k sampled days, see sample. Only drawn days not featurized before
+        are featurized.
+
+        Returns:
+        - feature_table: pandas DataFrame with id and the features, one row per drawn day.
+        """
+        return self._feature_rows(self.sample(k, replace=replace, rng=rng))
+
+
+def fixed_time_sliding_window_0oclock_1random_day(df, id, hour=24, features=None, fill='spline', max_gap=15,
+                                                  rng=None, cache=None):
+    # Features of one randomly chosen midnight-anchored window with 95% coverage, drawn
+    # uniformly over calendar days from the subject's QualifyingDays index; only the drawn
+    # day is featurized. Pass an int seed or numpy Generator as rng for a
+    # reproducible draw. The subject is regularized onto the 5-minute grid once, gaps of up to
+    # max_gap minutes filled as in regularize_glucose (default: quadratic spline over dropouts
+    # of up to 15 minutes). cache is an optional feature_cache.FeatureCache.
+    features = list(RANDOM_DAY_FEATURE_NAMES if features is None else features)
+    days = QualifyingDays(df, id, hour=hour, coverage=0.95, features=features, fill=fill, max_gap=max_gap,
+                          cache=cache)
+
+    # The reported id is the subject's
+    feature_table = days.sample_features(1, rng=rng)
+    feature_table['id'] = id
 
     # Reorder columns to match desired feature names
-    feature_names = [
-        "id", "mean", "median", "min", "max", "fq", "tq",
-        "interdaysd", "interdaycv", "TOR", "TIR", "MGE", "MGN",
-        "J_index", "LBGI", "HBGI", "ADRR", "TA140", "TA200"
-    ]
-    feature_table = feature_table.reindex(columns=feature_names)
+    feature_table = feature_table.reindex(columns=["id"] + features)
 
     return feature_table
@@ -0,0 +1,147 @@
+## Labelled, Tomek-link cleaned and class-balanced training sets from window feature tables
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import NearestNeighbors
+
+import cgmquantify_stuart as cgm
+
+
+def derive_labels(ids, patterns=None, mapping=None, default=0):
+    """
+    Label window ids without a Python loop.
+
+    Parameters:
+    - ids: array-like of window ids (e.g. "<subject>_win<n>") or subject ids.
+    - patterns: dict mapping an id substring to its label, checked in order; the first
+      match wins (default: {'T1D': 1}, as in Sample Dataset Creation.ipynb).
+    - mapping: dict or pandas Series mapping subject ids to labels; takes precedence over
+      patterns for the subjects it contains.
+    - default: the label of ids matching nothing.
+
+    Returns:
+    - labels: numpy array of shape (n_ids,).
+    """
+    ids = pd.Series(np.asarray(ids, dtype=object)).astype(str)
+    patterns = {'T1D': 1} if patterns is None and mapping is None else (patterns or {})
+    labels = np.full(len(ids), default, dtype=object)
+    unmatched = np.ones(len(ids), dtype=bool)
+    for pattern, label in patterns.items():
+        match = unmatched & ids.str.contains(pattern, regex=False).to_numpy()
+        labels[match] = label
+        unmatched &= ~match
+    if mapping is not None:
+        mapping = pd.Series(mapping)
+        subjects = ids.str.replace(r'_win\d+$', '', regex=True)
+        known = subjects.isin(mapping.index).to_numpy()
+        labels[known] = subjects[known].map(mapping).to_numpy(dtype=object)
+    return pd.Series(labels).infer_objects().to_numpy()
+
+
+def nearest_other(X, index=None, chunk_size=10_000, n_jobs=1):
+    """
+    Nearest neighbor of every row of X among the rows of X, as used for Tomek links.
+
+    Parameters:
+    - X: numpy array of shape (n_samples, n_features).
+    - index: fitted sklearn NearestNeighbors on X, to reuse between calls (default: fit one).
+    - chunk_size: int, rows queried per chunk, which bounds the memory of a query.
+    - n_jobs: int, threads querying chunks in parallel; 1 runs in the calling thread.
+
+    Returns:
+    - neighbors: numpy array of shape (n_samples,), the position of each row's nearest
+      neighbor (the second of its two nearest rows, itself being the first).
+    """
+    X = np.asarray(X, dtype=float)
+    if index is None:
+        index = NearestNeighbors(n_neighbors=2).fit(X)
+    chunks = [X[start:start + chunk_size] for start in range(0, len(X), chunk_size)]
+
+    def query(chunk):
+        return index.kneighbors(chunk, n_neighbors=2, return_distance=False)[:, 1]
+
+    if n_jobs == 1 or len(chunks) <= 1:
+        parts = [query(chunk) for chunk in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            parts = list(executor.map(query, chunks))
+    return np.concatenate(parts) if parts else np.empty(0, dtype=int)
+
+
+def tomek_links(X, y, sampling_strategy='majority', index=None, chunk_size=10_000, n_jobs=1):
+    """
+    Find the samples to drop for Tomek-link undersampling, as imblearn's TomekLinks does.
+
+    Parameters:
+    - X: numpy array of shape (n_samples, n_features).
+    - y: array-like of shape (n_samples,), the labels.
+    - sampling_strategy: 'majority' drops only majority-class members of a link, 'all'
+      drops both members.
+    - index, chunk_size, n_jobs: see nearest_other.
+
+    Returns:
+    - links: boolean numpy array of shape (n_samples,), True for samples to drop.
+    """
+    y = np.asarray(y)
+    neighbors = nearest_other(X, index=index, chunk_size=chunk_size, n_jobs=n_jobs)
+    mutual = neighbors[neighbors] == np.arange(len(y))
+    links = mutual & (y[neighbors] != y)
+    if sampling_strategy == 'majority':
+        classes, counts = np.unique(y, return_counts=True)
+        links &= y == classes[np.argmax(counts)]
+    elif sampling_strategy != 'all':
+        raise ValueError(f"sampling_strategy must be 'majority' or 'all', not {sampling_strategy!r}")
+    return links
+
+
+def balanced_sample(feature_table, label_column='label', seed=0):
+    """
+    Downsample every class to the size of the smallest one with a seeded generator.
+
+    Parameters:
+    - feature_table: pandas DataFrame with a label column.
+    - label_column: str, the label column.
+    - seed: int seed or numpy Generator.
+
+    Returns:
+    - balanced: pandas DataFrame with the same number of rows per class, classes in sorted
+      order and rows of a class in their original order.
+    """
+    rng = np.random.default_rng(seed)
+    labels = feature_table[label_column].to_numpy()
+    classes, counts = np.unique(labels, return_counts=True)
+    n = counts.min() if len(counts) else 0
+    keep = [np.sort(rng.choice(np.flatnonzero(labels == label), size=n, replace=False)) for label in classes]
+    positions = np.concatenate(keep) if keep else np.empty(0, dtype=int)
+    return feature_table.iloc[positions].reset_index(drop=True)
+
+
+def build_balanced_dataset(feature_table, feature_names=None, patterns=None, mapping=None, label_column='label',
+                           tomek=True, seed=0, chunk_size=10_000, n_jobs=1):
+    """
+    Training-set build of Sample Dataset Creation.ipynb as one reproducible stage: drop
+    incomplete windows, label them, remove majority-class Tomek links and balance classes.
+
+    Parameters:
+    - feature_table: pandas DataFrame with an id column and window features.
+    - feature_names: list of str, the columns used for the neighbor search
+      (default: the cgm.GLYCEMIC_FEATURE_NAMES present in the table).
+    - patterns, mapping: see derive_labels.
+    - label_column: str, the label column added to the table.
+    - tomek: bool, remove Tomek links before balancing.
+    - seed: int seed or numpy Generator for the balanced sample.
+    - chunk_size, n_jobs: see nearest_other.
+
+    Returns:
+    - balanced: pandas DataFrame with the label column, the same number of rows per class.
+    """
+    if feature_names is None:
+        feature_names = [name for name in cgm.GLYCEMIC_FEATURE_NAMES if name in feature_table]
+    feature_table = feature_table.dropna().reset_index(drop=True)
+    feature_table[label_column] = derive_labels(feature_table['id'], patterns=patterns, mapping=mapping)
+    if tomek and len(feature_table) > 1:
+        links = tomek_links(feature_table[list(feature_names)].to_numpy(dtype=float), feature_table[label_column],
+                            chunk_size=chunk_size, n_jobs=n_jobs)
+        feature_table = feature_table[~links].reset_index(drop=True)
+    return balanced_sample(feature_table, label_column=label_column, seed=seed)
@@ -0,0 +1,197 @@
+## Benchmarks of the extraction and scoring pipeline on synthetic CGM data
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import scipy
+import sklearn
+
+import CGM_TAML as taml
+from calculate_scores import SilhouetteScorer, dunn_index
+from cgm_io import read_cgm_csv
+from profiling import Profiler
+from synthetic_cgm import generate_cgm
+
+# Scenario name -> generate_cgm parameters
+SCENARIOS = {
+    'small': {'n_subjects': 100, 'n_days': 14},
+    'medium': {'n_subjects': 1000, 'n_days': 14},
+    'large': {'n_subjects': 10000, 'n_days': 14},
+    'small_1min': {'n_subjects': 100, 'n_days': 14, 'sampling_minutes': 1},
+    'small_15min': {'n_subjects': 100, 'n_days': 14, 'sampling_minutes': 15},
+    'sparse': {'n_subjects': 1000, 'n_days': 14, 'gap_rate': 3.0},
+}
+
+# Modules whose cold import is measured by import_times
+IMPORT_MODULES = ['cgmquantify_stuart', 'CGM_TAML', 'calculate_scores', 'cohort_extraction']
+
+# Runs in a fresh interpreter: import one module and report its cost as JSON
+_IMPORT_PROBE = """
+import importlib, json, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+except ImportError:
+    rss = None
+print(json.dumps({'seconds': seconds, 'max_rss_mb': rss, 'n_modules': len(sys.modules)}))
+"""
+
+
+@contextmanager
+def _timed(stages, name):
+    start = time.perf_counter()
+    yield
+    stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def run_scenario(name, seed=0, n_scored=1000, **overrides):
+    """
+    Run one benchmark scenario and time each pipeline stage separately.
+
+    Stages: ingestion (read_cgm_csv of the synthetic CSV), window_bounds and regularization
+    (the profiled stages of one daily_glucose_windows call per subject: midnight anchors and
+    window bounds, then the 5-minute grid and window views), featurization
+    (quantify_glycemic_features_batch over all windows), dunn_index and silhouette
+    (SilhouetteScorer on n_scored points) on a 2-D projection of the standardized features.
+
+    Parameters:
+    - name: str, a key of SCENARIOS.
+    - seed: int, the seed of the synthetic data.
+    - n_scored: int, the number of windows scored against the reference set.
+    - **overrides: generate_cgm parameters replacing the scenario's.
+
+    Returns:
+    - result: dict with the scenario, its parameters, data sizes, stage timings in seconds
+      and the software environment.
+    """
+    params = dict(SCENARIOS[name], **overrides)
+    stages = {}
+
+    df = generate_cgm(seed=seed, **params)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cgm.csv')
+        df.to_csv(path, index=False)
+        with _timed(stages, 'ingestion'):
+            df = read_cgm_csv(path)
+
+    subjects = [(id, subject_df.reset_index(drop=True)) for id, subject_df in df.groupby('ID', sort=False)]
+    profiler = Profiler()
+    window_ids, matrices, lengths = [], [], []
+    for id, subject_df in subjects:
+        ids, glucose, subject_lengths = taml.daily_glucose_windows(subject_df, id, profiler=profiler)
+        window_ids.append(ids)
+        matrices.append(glucose)
+        lengths.append(subject_lengths)
+    for stage in ('window_bounds', 'regularization'):
+        stages[stage] = profiler.seconds.get(stage, 0.0)
+    window_ids = np.concatenate(window_ids)
+    glucose = np.vstack(matrices)
+    lengths = np.concatenate(lengths)
+
+    with _timed(stages, 'featurization'):
+        feature_table = taml.quantify_glycemic_features_batch(glucose, window_ids, lengths)
+
+    # A fixed random projection stands in for the UMAP embedding, which is not benchmarked here
+    features = feature_table.drop(columns='id').dropna()
+    X = ((features - features.mean()) / features.std().replace(0, 1)).to_numpy()
+    embedding = X @ np.random.default_rng(seed).normal(size=(X.shape[1], 2))
+    labels = (features['mean'].to_numpy() > features['mean'].median()).astype(int)
+
+    # Scoring needs two clusters; sparse scenarios (e.g. 15-minute sampling) may yield no windows
+    scored = np.random.default_rng(seed).choice(len(embedding), min(n_scored, len(embedding)), replace=False)
+    if len(np.unique(labels)) > 1:
+        with _timed(stages, 'dunn_index'):
+            dunn_index(embedding, labels)
+        with _timed(stages, 'silhouette'):
+            SilhouetteScorer(embedding, labels).score(embedding[scored], labels[scored])
+
+    return {
+        'scenario': name,
+        'params': params,
+        'seed': seed,
+        'n_readings': len(df),
+        'n_windows': len(feature_table),
+        'n_scored': len(scored),
+        'stages': stages,
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'scipy': scipy.__version__,
+            'scikit-learn': sklearn.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+        },
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def import_times(modules=None, repeats=5):
+    """
+    Cold-start cost of importing each module, as paid by every new worker process or
+    short-lived scoring invocation. Each import runs in a fresh interpreter.
+
+    Parameters:
+    - modules: list of str, module names importable from this directory (default: IMPORT_MODULES).
+    - repeats: int, interpreters started per module; the median is reported.
+
+    Returns:
+    - times: dict mapping each module to its median import seconds, median peak resident
+      memory in MB of the interpreter after the import (None where unavailable) and the
+      number of modules loaded.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = {}
+    for module in modules or IMPORT_MODULES:
+        runs = []
+        for _ in range(repeats):
+            output = subprocess.run([sys.executable, '-c', _IMPORT_PROBE, module], cwd=here, check=True,
+                                    capture_output=True, text=True).stdout
+            runs.append(json.loads(output.splitlines()[-1]))
+        rss = [run['max_rss_mb'] for run in runs if run['max_rss_mb'] is not None]
+        times[module] = {
+            'seconds': float(np.median([run['seconds'] for run in runs])),
+            'max_rss_mb': float(np.median(rss)) if rss else None,
+            'n_modules': runs[0]['n_modules'],
+        }
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CGM feature pipeline on synthetic data.")
+    parser.add_argument("scenarios", nargs="*", default=["small"], choices=sorted(SCENARIOS),
+                        help="scenarios to run (default: small)")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--imports", action="store_true", help="also measure the cold import time of the modules")
+    args = parser.parse_args(argv)
+
+    results = []
+    if args.imports:
+        times = import_times()
+        results.append({'scenario': 'imports', 'modules': times, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')})
+        for module, cost in times.items():
+            print(f"import {module}: {cost['seconds']:.3f}s, {cost['n_modules']} modules loaded")
+    for name in args.scenarios:
+        result = run_scenario(name, seed=args.seed)
+        results.append(result)
+        timings = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result['stages'].items())
+        print(f"{name}: {result['n_readings']} readings, {result['n_windows']} windows; {timings}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
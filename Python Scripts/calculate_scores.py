@@ -1,36 +1,73 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import numpy as np
-from scipy.spatial.distance import pdist, squareform
+from scipy.spatial import ConvexHull, cKDTree
+from scipy.spatial.distance import cdist
 from sklearn.metrics import pairwise_distances
+from sklearn.metrics.pairwise import euclidean_distances
 
-def dunn_index(umap_coordinates, labels):
-    # Calculate pairwise distances between all samples
-    distances = squareform(pdist(umap_coordinates))
-    # print("distance calculated")
-    # Initialize variables to track the smallest inter-cluster and largest intra-cluster distances
-    smallest_inter_cluster_distance = np.inf
-    largest_intra_cluster_distance = 0
-    
-    # Identify unique clusters
+def _diameter_candidates(points):
+    # The farthest pair of a point set lies on its convex hull; only worth it in low dimensions
+    if points.shape[1] == 1:
+        return np.array([points.min(axis=0), points.max(axis=0)])
+    if points.shape[1] > 3 or len(points) <= points.shape[1] + 1:
+        return points
+    try:
+        return points[ConvexHull(points).vertices]
+    except RuntimeError:
+        # QhullError: degenerate sets (collinear, duplicated points) have no full-dimensional hull
+        return points
+
+def _max_pairwise_distance(points, memory_budget):
+    # Largest distance within a point set, computed in row blocks of the upper triangle
+    n = len(points)
+    block = max(1, int(memory_budget // (8 * max(n, 1))))
+    largest = 0.0
+    for start in range(0, n, block):
+        distances = cdist(points[start:start + block], points[start:])
+        largest = max(largest, distances.max())
+    return largest
+
+def dunn_index(umap_coordinates, labels, memory_budget=256 * 2**20):
+    """
+    Calculate the Dunn index (smallest inter-cluster distance over largest intra-cluster
+    distance) without materializing the full pairwise distance matrix.
+
+    The smallest inter-cluster distance comes from exact nearest-neighbor queries on a
+    KD-tree per cluster, and the largest intra-cluster distance from a blocked search over
+    each cluster's convex hull vertices (all points in more than three dimensions).
+
+    Parameters:
+    - umap_coordinates: numpy array of shape (n_samples, n_features), the embedding coordinates.
+    - labels: numpy array of shape (n_samples,), the cluster labels.
+    - memory_budget: int, the maximum size in bytes of one block of distances.
+
+    Returns:
+    - dunn_index: float, the Dunn index.
+    """
+    X = np.asarray(umap_coordinates, dtype=float)
+    labels = np.asarray(labels)
     clusters = np.unique(labels)
-    
+    if len(clusters) < 2:
+        raise ValueError("dunn_index needs at least two clusters")
+
+    # Largest intra-cluster distance
+    largest_intra_cluster_distance = 0
     for cluster in clusters:
-        # Indices of samples in the current cluster
-        in_cluster = labels == cluster
-        # Indices of samples not in the current cluster
-        not_in_cluster = ~in_cluster
-        
-        # Intra-cluster distances for the current cluster
-        intra_cluster_distances = distances[in_cluster][:, in_cluster]
-        # Update the largest intra-cluster distance if necessary
-        largest_intra_cluster = np.max(intra_cluster_distances)
-        largest_intra_cluster_distance = max(largest_intra_cluster, largest_intra_cluster_distance)
-        
-        # Inter-cluster distances between current cluster and other clusters
-        inter_cluster_distances = distances[in_cluster][:, not_in_cluster]
-        # Update the smallest inter-cluster distance if necessary
-        smallest_inter_cluster = np.min(inter_cluster_distances)
-        smallest_inter_cluster_distance = min(smallest_inter_cluster, smallest_inter_cluster_distance)
-    
+        candidates = _diameter_candidates(X[labels == cluster])
+        largest_intra_cluster_distance = max(
+            _max_pairwise_distance(candidates, memory_budget), largest_intra_cluster_distance
+        )
+
+    # Smallest inter-cluster distance: each pair of clusters is queried once
+    smallest_inter_cluster_distance = np.inf
+    for i, cluster in enumerate(clusters[:-1]):
+        tree = cKDTree(X[labels == cluster])
+        others = X[np.isin(labels, clusters[i + 1:])]
+        distances, _ = tree.query(others, k=1)
+        smallest_inter_cluster_distance = min(distances.min(), smallest_inter_cluster_distance)
+
     # Calculate Dunn's Index
     dunn_index = smallest_inter_cluster_distance / largest_intra_cluster_distance
     return dunn_index
@@ -71,3 +108,331 @@ def calculate_silhouette_score(X, labels, new_point, new_point_label):
     silhouette_score = (b - a) / max(a, b) if max(a, b) > 0 else 0
 
     return silhouette_score
+
+_WORKER_SCORER = None
+
+def _init_scorer_worker(scorer):
+    # Process pool initializer: ship the reference set to each worker once
+    global _WORKER_SCORER
+    _WORKER_SCORER = scorer
+
+def _worker_cluster_mean_distances(points):
+    return _WORKER_SCORER._cluster_mean_distances(points)
+
+class SilhouetteScorer:
+    """
+    Silhouette scoring of new points against a fixed reference set.
+
+    The reference coordinates, their squared norms and a one-hot cluster matrix are
+    prepared once; batches of new points are then scored in chunks whose distance
+    blocks stay within memory_budget bytes, optionally over a thread or process pool.
+
+    Parameters:
+    - X: numpy array of shape (n_samples, n_features), the reference coordinates.
+    - labels: numpy array of shape (n_samples,), the reference cluster labels.
+    - memory_budget: int, the maximum size in bytes of one block of distances.
+    """
+
+    def __init__(self, X, labels, memory_budget=64 * 2**20):
+        self.X = np.ascontiguousarray(X, dtype=float)
+        self.labels = np.asarray(labels)
+        self.clusters, codes, self.counts = np.unique(self.labels, return_inverse=True, return_counts=True)
+        self.memory_budget = memory_budget
+        self._X_norm_squared = np.einsum('ij,ij->i', self.X, self.X)[np.newaxis, :]
+        self._onehot = np.zeros((len(self.X), len(self.clusters)))
+        self._onehot[np.arange(len(self.X)), codes] = 1.0
+
+    def _cluster_mean_distances(self, points):
+        # Mean distance from each point to each reference cluster, blocked over the reference set
+        block = max(1, int(self.memory_budget // (8 * max(len(points), 1))))
+        sums = np.zeros((len(points), len(self.clusters)))
+        for start in range(0, len(self.X), block):
+            distances = euclidean_distances(
+                points, self.X[start:start + block],
+                Y_norm_squared=self._X_norm_squared[:, start:start + block],
+            )
+            sums += distances @ self._onehot[start:start + block]
+        return sums / self.counts
+
+    def cluster_mean_distances(self, points, chunk_size=1024, n_jobs=1, backend='thread'):
+        """
+        Mean distance from each point to the reference points of each cluster.
+
+        Parameters:
+        - points: numpy array of shape (n_points, n_features).
+        - chunk_size: int, points per vectorized call.
+        - n_jobs: int, parallel workers; 1 runs in the calling thread.
+        - backend: 'thread' or 'process'.
+
+        Returns:
+        - means: numpy array of shape (n_points, n_clusters), columns ordered as self.clusters.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        chunks = [points[start:start + chunk_size] for start in range(0, len(points), chunk_size)]
+        if n_jobs == 1 or len(chunks) <= 1:
+            results = [self._cluster_mean_distances(chunk) for chunk in chunks]
+        elif backend == 'thread':
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                results = list(executor.map(self._cluster_mean_distances, chunks))
+        elif backend == 'process':
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_scorer_worker, initargs=(self,)) as executor:
+                results = list(executor.map(_worker_cluster_mean_distances, chunks))
+        else:
+            raise ValueError(f"backend must be 'thread' or 'process', got {backend!r}")
+        if not results:
+            return np.zeros((0, len(self.clusters)))
+        return np.vstack(results)
+
+    def score(self, points, point_labels, method='mean_other', chunk_size=1024, n_jobs=1, backend='thread'):
+        """
+        Silhouette scores of a batch of new points.
+
+        Parameters:
+        - points: numpy array of shape (n_points, n_features), the new point coordinates.
+        - point_labels: numpy array of shape (n_points,), the cluster labels of the new points.
+        - method: 'mean_other' compares with the mean distance to all points of other clusters,
+          as calculate_silhouette_score does; 'nearest' uses the nearest other cluster, as in
+          the standard silhouette.
+        - chunk_size, n_jobs, backend: see cluster_mean_distances.
+
+        Returns:
+        - silhouette_scores: numpy array of shape (n_points,).
+        """
+        if method not in ('mean_other', 'nearest'):
+            raise ValueError(f"method must be 'mean_other' or 'nearest', got {method!r}")
+        means = self.cluster_mean_distances(points, chunk_size=chunk_size, n_jobs=n_jobs, backend=backend)
+        point_labels = np.asarray(point_labels)
+        own = point_labels[:, np.newaxis] == self.clusters[np.newaxis, :]
+        has_own = own.any(axis=1)
+        has_other = (~own).any(axis=1)
+
+        # Intra-cluster distance, 0 when the reference has no point with the same label
+        a = np.where(has_own, np.where(own, means, 0.0).sum(axis=1), 0.0)
+        if method == 'mean_other':
+            other_counts = np.where(own, 0, self.counts)
+            other_total = other_counts.sum(axis=1)
+            b = (means * other_counts).sum(axis=1) / np.maximum(other_total, 1)
+        else:
+            b = np.where(own, np.inf, means).min(axis=1)
+        b = np.where(has_other, b, a)
+
+        largest = np.maximum(a, b)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(largest > 0, (b - a) / largest, 0.0)
+
+def stratified_sample(labels, size, seed=0):
+    """
+    Positions of a random sample stratified by label, with allocation proportional to the
+    label counts and at least one point of every label.
+
+    The positions are interleaved across labels so that every prefix of the sample is
+    itself close to proportional, which keeps a sample cut short by a time budget stratified.
+
+    Parameters:
+    - labels: numpy array of shape (n_samples,), the cluster labels.
+    - size: int, the sample size (the whole set when larger).
+    - seed: int seed or numpy Generator.
+
+    Returns:
+    - positions: numpy array of int positions into labels.
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels)
+    clusters, codes, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    size = min(int(size), len(labels))
+    # Largest-remainder allocation, then at least one point per label
+    exact = counts * size / max(len(labels), 1)
+    quota = np.floor(exact).astype(int)
+    quota[np.argsort(quota - exact, kind='stable')[:size - quota.sum()]] += 1
+    quota = np.clip(quota, 1, counts)
+
+    positions, keys = [], []
+    for code, n in enumerate(quota):
+        positions.append(rng.choice(np.flatnonzero(codes == code), size=n, replace=False))
+        keys.append((np.arange(n) + 0.5) / n)
+    if not positions:
+        return np.empty(0, dtype=int)
+    order = np.argsort(np.concatenate(keys), kind='stable')
+    return np.concatenate(positions)[order]
+
+def _stratified_bootstrap(values, strata, weights, n_bootstrap, rng, block_size=2**20):
+    # Weighted mean of per-stratum means for n_bootstrap resamples drawn within each stratum
+    estimates = np.zeros(n_bootstrap)
+    for stratum, weight in weights.items():
+        members = values[strata == stratum]
+        rows = max(1, block_size // len(members))
+        for start in range(0, n_bootstrap, rows):
+            draws = rng.integers(0, len(members), size=(min(rows, n_bootstrap - start), len(members)))
+            estimates[start:start + len(draws)] += weight * members[draws].mean(axis=1)
+    return estimates
+
+def approximate_silhouette(umap_coordinates, labels, n_points=2000, n_reference=50_000, method='mean_other',
+                           n_bootstrap=1000, confidence=0.95, time_budget=None, seed=0, chunk_size=256,
+                           memory_budget=64 * 2**20):
+    """
+    Estimate the mean silhouette score of a large embedding from a stratified sample, with a
+    stratified bootstrap confidence interval.
+
+    n_points points, stratified by label, are scored with SilhouetteScorer against a
+    stratified reference sample of n_reference points (the whole set when None). The
+    estimate weights each label's mean score by the label's share of the full set. The
+    interval covers the sampling of the scored points; the reference sample adds a further
+    error in the cluster mean distances, negligible when n_reference is large and zero
+    when it is None.
+
+    Parameters:
+    - umap_coordinates: numpy array of shape (n_samples, n_features), the embedding coordinates.
+    - labels: numpy array of shape (n_samples,), the cluster labels.
+    - n_points: int, the number of scored points.
+    - n_reference: int, the reference sample size, or None for the whole set.
+    - method: 'mean_other' or 'nearest', see SilhouetteScorer.score.
+    - n_bootstrap: int, the bootstrap resamples.
+    - confidence: float, the coverage of the percentile interval.
+    - time_budget: float, seconds after which no further chunk of points is scored
+      (default: score all n_points); at least one chunk is always scored.
+    - seed: int, the seed of the samples and the bootstrap.
+    - chunk_size: int, points scored per call.
+    - memory_budget: int, the maximum size in bytes of one block of distances.
+
+    Returns:
+    - result: dict with silhouette (the estimate), ci_low, ci_high, std_error, per_cluster
+      (dict of mean scores by label), n_scored, n_reference and seconds.
+    """
+    start = time.perf_counter()
+    X = np.asarray(umap_coordinates, dtype=float)
+    labels = np.asarray(labels)
+    rng = np.random.default_rng(seed)
+    clusters, counts = np.unique(labels, return_counts=True)
+    if len(clusters) < 2:
+        raise ValueError("approximate_silhouette needs at least two clusters")
+
+    reference = np.arange(len(X)) if n_reference is None else stratified_sample(labels, n_reference, rng)
+    scorer = SilhouetteScorer(X[reference], labels[reference], memory_budget=memory_budget)
+    sample = stratified_sample(labels, n_points, rng)
+    scores = []
+    for chunk_start in range(0, len(sample), chunk_size):
+        chunk = sample[chunk_start:chunk_start + chunk_size]
+        scores.append(scorer.score(X[chunk], labels[chunk], method=method))
+        if time_budget is not None and time.perf_counter() - start > time_budget:
+            break
+    scores = np.concatenate(scores)
+    scored_labels = labels[sample[:len(scores)]]
+
+    # Labels missing from a truncated sample are left out and the weights renormalized
+    present = np.isin(clusters, scored_labels)
+    weights = dict(zip(clusters[present].tolist(), counts[present] / counts[present].sum()))
+    per_cluster = {label: float(scores[scored_labels == label].mean()) for label in weights}
+    estimate = sum(weight * per_cluster[label] for label, weight in weights.items())
+    bootstrap = _stratified_bootstrap(scores, scored_labels, weights, n_bootstrap, rng)
+    tail = (1 - confidence) / 2
+    return {
+        'silhouette': float(estimate),
+        'ci_low': float(np.quantile(bootstrap, tail)),
+        'ci_high': float(np.quantile(bootstrap, 1 - tail)),
+        'std_error': float(bootstrap.std(ddof=1)) if n_bootstrap > 1 else float('nan'),
+        'per_cluster': per_cluster,
+        'n_scored': len(scores),
+        'n_reference': len(reference),
+        'seconds': time.perf_counter() - start,
+    }
+
+def _diameter_bounds(points, sample, n_directions, rng, memory_budget):
+    # Lower and upper bounds on the largest distance within a point set: exact over the
+    # convex hull in up to three dimensions, or over all points when the sample covers them;
+    # otherwise the largest distance among the sampled positions and directionally extreme
+    # points, and twice the largest distance to the centroid
+    if points.shape[1] <= 3:
+        diameter = _max_pairwise_distance(_diameter_candidates(points), memory_budget)
+        return diameter, diameter
+    if len(np.unique(sample)) == len(points):
+        diameter = _max_pairwise_distance(points, memory_budget)
+        return diameter, diameter
+    directions = rng.normal(size=(points.shape[1], n_directions))
+    projections = points @ directions
+    extremes = np.unique(np.concatenate([projections.argmin(axis=0), projections.argmax(axis=0), sample]))
+    lower = _max_pairwise_distance(points[extremes], memory_budget)
+    upper = 2 * np.sqrt(((points - points.mean(axis=0))**2).sum(axis=1).max())
+    return lower, upper
+
+def approximate_dunn_index(umap_coordinates, labels, n_points=10_000, confidence=0.95, time_budget=None, seed=0,
+                           chunk_size=1024, n_directions=64, memory_budget=256 * 2**20):
+    """
+    Approximate the Dunn index of a large embedding with explicit error reporting.
+
+    The Dunn index is set by extreme points (the closest pair of points in different
+    clusters and the farthest pair within a cluster), which a plain subsample misses. Here
+    a stratified sample of n_points points is queried against KD-trees over the full
+    clusters, so the separation found is an achieved distance: it can only overestimate
+    the exact one, and the probability that a closer point was missed is bounded by
+    tail_fraction. Cluster diameters are exact in up to three dimensions (convex hull of the
+    full cluster) and for clusters the sample covers entirely; otherwise they are bracketed by
+    an achieved distance among sampled and directionally extreme points and twice the
+    largest distance to the centroid.
+
+    Parameters:
+    - umap_coordinates: numpy array of shape (n_samples, n_features), the embedding coordinates.
+    - labels: numpy array of shape (n_samples,), the cluster labels.
+    - n_points: int, the number of points queried for the separation.
+    - confidence: float, the confidence of tail_fraction.
+    - time_budget: float, seconds after which no further chunk of points is queried
+      (default: query all n_points); at least one chunk is always queried.
+    - seed: int, the seed of the sample and the directions.
+    - chunk_size: int, points queried per call.
+    - n_directions: int, random directions whose extreme points bound diameters above three dimensions.
+    - memory_budget: int, the maximum size in bytes of one block of distances.
+
+    Returns:
+    - result: dict with
+      - dunn_index: separation / diameter, an upper bound on the exact Dunn index; exact
+        when the closest pair was queried and diameter_exact is True.
+      - separation: the smallest distance found between points of different clusters.
+      - diameter, diameter_upper: bounds on the largest intra-cluster distance.
+      - diameter_exact: bool.
+      - tail_fraction: with the given confidence, at most this fraction of points lies
+        closer to another cluster than separation.
+      - n_queried, seconds.
+    """
+    start = time.perf_counter()
+    X = np.asarray(umap_coordinates, dtype=float)
+    labels = np.asarray(labels)
+    rng = np.random.default_rng(seed)
+    clusters = np.unique(labels)
+    if len(clusters) < 2:
+        raise ValueError("approximate_dunn_index needs at least two clusters")
+    sample = stratified_sample(labels, n_points, rng)
+
+    diameter, diameter_upper = 0.0, 0.0
+    trees = {}
+    for cluster in clusters:
+        members = np.flatnonzero(labels == cluster)
+        cluster_sample = np.searchsorted(members, sample[labels[sample] == cluster])
+        lower, upper = _diameter_bounds(X[members], cluster_sample, n_directions, rng, memory_budget)
+        diameter, diameter_upper = max(diameter, lower), max(diameter_upper, upper)
+        trees[cluster] = cKDTree(X[members])
+
+    # Distance from each queried point to the nearest point of any other (full) cluster
+    separation, n_queried = np.inf, 0
+    for chunk_start in range(0, len(sample), chunk_size):
+        chunk = sample[chunk_start:chunk_start + chunk_size]
+        for cluster, tree in trees.items():
+            others = chunk[labels[chunk] != cluster]
+            if len(others):
+                distances, _ = tree.query(X[others], k=1)
+                separation = min(separation, distances.min())
+        n_queried += len(chunk)
+        if time_budget is not None and time.perf_counter() - start > time_budget:
+            break
+
+    exact = n_queried == len(X)
+    with np.errstate(divide='ignore'):
+        dunn_index = float(np.float64(separation) / diameter)
+    return {
+        'dunn_index': dunn_index,
+        'separation': float(separation),
+        'diameter': float(diameter),
+        'diameter_upper': float(diameter_upper),
+        'diameter_exact': bool(diameter == diameter_upper),
+        'tail_fraction': 0.0 if exact else float(1 - (1 - confidence)**(1 / n_queried)),
+        'n_queried': n_queried,
+        'seconds': time.perf_counter() - start,
+    }
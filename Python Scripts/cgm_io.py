@@ -0,0 +1,367 @@
+## Reading and storing CGM data in the id/gl/time layout described in the README
+import argparse
+import importlib.util
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def _to_cgm_layout(df):
+    # Rename README columns to the ID/Glucose/Time layout used by CGM_TAML
+    df = df.rename(columns={"id": "ID", "gl": "Glucose", "time": "Time"})
+    df.ID = df.ID.astype(str)
+    df.Time = pd.to_datetime(df.Time)
+    return df
+
+
+def read_cgm_csv(path):
+    """
+    Read a CGM CSV with id, gl and time columns into the ID/Glucose/Time layout
+    used by CGM_TAML.
+
+    Parameters:
+    - path: str, path to the CSV file.
+
+    Returns:
+    - df: pandas DataFrame with ID (str), Glucose (float) and Time (datetime64) columns.
+    """
+    return _to_cgm_layout(pd.read_csv(path, dtype={"id": str}))
+
+
+def iter_subjects_csv(path, chunksize=1_000_000):
+    """
+    Stream a CGM CSV one subject at a time.
+
+    The file must be grouped by id (all rows of a subject are contiguous), as required
+    by the README. A subject is yielded as soon as the first row of the next subject
+    has been read, so memory is bounded by the largest subject plus one chunk.
+
+    Parameters:
+    - path: str, path to the CSV file with id, gl and time columns.
+    - chunksize: int, number of CSV rows parsed per chunk.
+
+    Yields:
+    - (id, df): the subject id and a DataFrame with ID, Glucose and Time columns.
+
+    Raises:
+    - ValueError: if a subject's rows are not contiguous in the file.
+    """
+    pending = []
+    seen = set()
+
+    def complete(pieces):
+        subject_df = pd.concat(pieces, ignore_index=True) if len(pieces) > 1 else pieces[0].reset_index(drop=True)
+        id = subject_df.ID.iloc[0]
+        if id in seen:
+            raise ValueError(f"rows of subject {id!r} are not contiguous; sort the input by id first")
+        seen.add(id)
+        return id, subject_df
+
+    for chunk in pd.read_csv(path, chunksize=chunksize, dtype={"id": str}):
+        if len(chunk) == 0:
+            continue
+        chunk = _to_cgm_layout(chunk)
+        ids = chunk.ID.to_numpy()
+        run_starts = np.concatenate(([0], np.flatnonzero(ids[1:] != ids[:-1]) + 1, [len(chunk)]))
+
+        # The first run may continue the subject carried over from the previous chunk
+        if pending and pending[0].ID.iloc[0] != ids[0]:
+            yield complete(pending)
+            pending = []
+        for start, end in zip(run_starts[:-2], run_starts[1:-1]):
+            pending.append(chunk.iloc[start:end])
+            yield complete(pending)
+            pending = []
+        # The last run may continue into the next chunk
+        pending.append(chunk.iloc[run_starts[-2]:])
+
+    if pending:
+        yield complete(pending)
+
+
+def write_cohort_store(subjects, path):
+    """
+    Write subjects into a memory-mappable columnar cohort store.
+
+    The store is a directory with int64 epoch-nanosecond timestamps (time.bin), float32
+    glucose (glucose.bin), a CSR-style int64 offset table (offsets.bin, one entry per
+    subject plus one) and the subject ids (meta.json). Rows of a subject are written
+    sorted by time.
+
+    Parameters:
+    - subjects: iterable of (id, df) pairs, df with Glucose and tz-naive Time columns,
+      e.g. iter_subjects_csv(csv_path).
+    - path: str, the store directory (created if missing, existing files are overwritten).
+
+    Returns:
+    - store: CohortStore opened on the written directory.
+    """
+    os.makedirs(path, exist_ok=True)
+    ids = []
+    offsets = [0]
+    with open(os.path.join(path, "time.bin"), "wb") as time_file, \
+            open(os.path.join(path, "glucose.bin"), "wb") as glucose_file:
+        for id, subject_df in subjects:
+            subject_df = subject_df.sort_values(by='Time')
+            time_file.write(subject_df.Time.to_numpy(dtype='datetime64[ns]').view(np.int64).tobytes())
+            glucose_file.write(subject_df.Glucose.to_numpy(dtype=np.float32).tobytes())
+            ids.append(str(id))
+            offsets.append(offsets[-1] + len(subject_df))
+    np.asarray(offsets, dtype=np.int64).tofile(os.path.join(path, "offsets.bin"))
+    with open(os.path.join(path, "meta.json"), "w") as meta_file:
+        json.dump({"version": 1, "n_readings": offsets[-1], "ids": ids}, meta_file)
+    return CohortStore(path)
+
+
+class CohortStore:
+    """
+    Read-only view of a cohort store written by write_cohort_store.
+
+    Columns are memory-mapped, so opening a store and slicing a subject neither parses
+    nor copies data; processes opening the same store share the OS page cache. Stores
+    pickle by path, which makes them cheap to send to process-pool workers.
+
+    Parameters:
+    - path: str, the store directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        self.ids = meta["ids"]
+        self.offsets = np.fromfile(os.path.join(path, "offsets.bin"), dtype=np.int64)
+        n_readings = meta["n_readings"]
+        self.time = self._map("time.bin", np.int64, n_readings)
+        self.glucose = self._map("glucose.bin", np.float32, n_readings)
+        self._positions = {id: position for position, id in enumerate(self.ids)}
+
+    def _map(self, name, dtype, n):
+        # np.memmap cannot map empty files
+        if n == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r', shape=(n,))
+
+    def __reduce__(self):
+        return (CohortStore, (self.path,))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def sizes(self):
+        # Number of readings per subject, in store order
+        return np.diff(self.offsets)
+
+    def arrays(self, id):
+        """
+        Zero-copy (time, glucose) slices of one subject: int64 epoch nanoseconds and float32 glucose.
+        """
+        position = self._positions[str(id)]
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.time[start:end], self.glucose[start:end]
+
+    def subject(self, id):
+        """
+        One subject as a DataFrame with ID, Glucose and Time columns, as expected by CGM_TAML.
+        """
+        time, glucose = self.arrays(id)
+        return pd.DataFrame({
+            "ID": str(id),
+            "Glucose": glucose.astype(float),
+            "Time": np.asarray(time).view('datetime64[ns]'),
+        })
+
+    def iter_subjects(self):
+        """
+        Yield (id, df) for every subject in store order.
+        """
+        for id in self.ids:
+            yield id, self.subject(id)
+
+
+def _replace_atomically(path, write):
+    # Write to a temporary file next to path, then rename it over path
+    tmp = path + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+class FeatureTableWriter:
+    """
+    Checkpointed, partitioned writer for feature tables produced one subject at a time.
+
+    Finished subjects are buffered and written as numbered partition files (Parquet when
+    pyarrow or fastparquet is installed, CSV otherwise) once the buffer holds
+    partition_rows rows. After each partition, manifest.json records the partition files
+    and the ids, input positions and row counts of every subject they cover, including
+    subjects without windows. Both are replaced atomically, so after a crash only the
+    buffered subjects are lost, and reopening the directory resumes: subjects in done can
+    be skipped. Subjects may finish in any order; readers restore input-position order.
+
+    Parameters:
+    - path: str, the output directory (created if missing).
+    - format: 'parquet' or 'csv' (default: parquet if available); an existing manifest's
+      format takes precedence.
+    - partition_rows: int, the number of buffered rows that triggers a partition write.
+    """
+
+    def __init__(self, path, format=None, partition_rows=100_000):
+        self.path = path
+        self.partition_rows = partition_rows
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+        else:
+            if format is None:
+                parquet = importlib.util.find_spec("pyarrow") or importlib.util.find_spec("fastparquet")
+                format = "parquet" if parquet else "csv"
+            self.manifest = {"version": 2, "format": format, "partitions": []}
+        self.format = self.manifest["format"]
+        self.done = {id for partition in self.manifest["partitions"] for id in partition["ids"]}
+        positions = [position for partition in self.manifest["partitions"]
+                     for position in partition.get("positions", [])]
+        self._next_position = max(positions, default=-1) + 1
+        self.rows_written = 0
+        self._buffer = []
+        self._rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def write(self, id, feature_table, position=None):
+        """
+        Buffer the feature table of one finished subject (possibly empty).
+
+        Parameters:
+        - id: the subject id.
+        - feature_table: pandas DataFrame, the subject's rows.
+        - position: int, the subject's position in the input, which orders the assembled
+          table (default: after every subject written so far).
+        """
+        if position is None:
+            position = self._next_position
+        self._next_position = max(self._next_position, position + 1)
+        self._buffer.append((int(position), str(id), feature_table))
+        self._rows += len(feature_table)
+        if self._rows >= self.partition_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered subjects as one partition and record them in the manifest.
+        """
+        if not self._buffer:
+            return
+        # Subjects in input order within the partition
+        buffer = sorted(self._buffer, key=lambda subject: subject[0])
+        tables = [table for _, _, table in buffer if len(table)]
+        partition = {"file": f"part-{len(self.manifest['partitions']):05d}.{self.format}",
+                     "ids": [id for _, id, _ in buffer], "positions": [position for position, _, _ in buffer],
+                     "rows": [len(table) for _, _, table in buffer], "n_rows": self._rows}
+        if tables:
+            feature_table = pd.concat(tables, ignore_index=True)
+            if self.format == "parquet":
+                write = lambda tmp: feature_table.to_parquet(tmp, index=False)
+            else:
+                write = lambda tmp: feature_table.to_csv(tmp, index=False)
+            _replace_atomically(os.path.join(self.path, partition["file"]), write)
+        else:
+            partition["file"] = None
+
+        self.manifest["partitions"].append(partition)
+
+        def write_manifest(tmp):
+            with open(tmp, "w") as manifest_file:
+                json.dump(self.manifest, manifest_file)
+        _replace_atomically(os.path.join(self.path, "manifest.json"), write_manifest)
+        self.done.update(partition["ids"])
+        self.rows_written += self._rows
+        self._buffer, self._rows = [], 0
+
+    def close(self):
+        self.flush()
+
+
+def _read_partition(path, manifest, partition):
+    partition_path = os.path.join(path, partition["file"])
+    if manifest["format"] == "parquet":
+        return pd.read_parquet(partition_path)
+    return pd.read_csv(partition_path, dtype={"id": str}, float_precision="round_trip")
+
+
+def iter_feature_partitions(path, ordered=True, batch_rows=100_000):
+    """
+    Yield the feature table of a FeatureTableWriter directory as DataFrames.
+
+    With ordered, rows come in subject input-position order whatever order subjects
+    finished or resumed in: subjects are merged across partitions, each partition being
+    read when first needed and released once all its subjects are yielded, and rows are
+    yielded in batches of about batch_rows. Otherwise (and for manifests written without
+    positions) the partitions are yielded as written.
+    """
+    with open(os.path.join(path, "manifest.json")) as manifest_file:
+        manifest = json.load(manifest_file)
+    partitions = [partition for partition in manifest["partitions"] if partition["file"] is not None]
+    if not ordered or not all("positions" in partition for partition in partitions):
+        for partition in partitions:
+            yield _read_partition(path, manifest, partition)
+        return
+
+    # (position, partition, first row, rows) of every subject with rows
+    subjects = []
+    for number, partition in enumerate(partitions):
+        offsets = np.concatenate([[0], np.cumsum(partition["rows"])])
+        subjects.extend((position, number, offsets[i], rows)
+                        for i, (position, rows) in enumerate(zip(partition["positions"], partition["rows"])) if rows)
+    subjects.sort()
+    remaining = [sum(1 for rows in partition["rows"] if rows) for partition in partitions]
+    loaded, batch, batch_size = {}, [], 0
+    for _, number, first, rows in subjects:
+        if number not in loaded:
+            loaded[number] = _read_partition(path, manifest, partitions[number])
+        batch.append(loaded[number].iloc[first:first + rows])
+        batch_size += rows
+        remaining[number] -= 1
+        if remaining[number] == 0:
+            del loaded[number]
+        if batch_size >= batch_rows:
+            yield pd.concat(batch, ignore_index=True)
+            batch, batch_size = [], 0
+    if batch:
+        yield pd.concat(batch, ignore_index=True)
+
+
+def read_feature_table(path, ordered=True):
+    """
+    Read the feature table written by a FeatureTableWriter.
+
+    Returns:
+    - feature_table: pandas DataFrame of every partition, subjects in input-position order
+      (in write order when ordered is False), see iter_feature_partitions.
+    """
+    tables = list(iter_feature_partitions(path, ordered=ordered))
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a CGM CSV into a memory-mapped cohort store.")
+    parser.add_argument("input", help="CSV with id, gl and time columns, grouped by id")
+    parser.add_argument("store", help="output store directory")
+    parser.add_argument("--chunksize", type=int, default=1_000_000, help="CSV rows parsed per chunk")
+    args = parser.parse_args(argv)
+
+    store = write_cohort_store(iter_subjects_csv(args.input, chunksize=args.chunksize), args.store)
+    print(f"{len(store)} subjects, {len(store.time)} readings written to {args.store}")
+
+
+if __name__ == "__main__":
+    main()
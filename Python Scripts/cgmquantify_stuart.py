@@ -1,8 +1,6 @@
 import pandas as pd
-import datetime as datetime
 import numpy as np
-import matplotlib.pyplot as plt
-from statsmodels.nonparametric.smoothers_lowess import lowess
+from profiling import NULL_PROFILER
 
 #     Functions:
 #     intradaycv(): Computes and returns the intraday coefficient of variation of glucose 
@@ -20,6 +18,7 @@ from statsmodels.nonparametric.smoothers_lowess import lowess
 #     ADRR(): Computes and returns the average daily risk range, an assessment of total daily glucose variations within risk space
 #     MODD(): Computes and returns the mean of daily differences. Examines mean of value + value 24 hours before
 #     CONGA24(): Computes and returns the continuous overall net glycemic action over 24 hours
+#     CONGA(): Computes and returns the continuous overall net glycemic action over n hours
 #     GMI(): Computes and returns the glucose management index
 #     eA1c(): Computes and returns the American Diabetes Association estimated HbA1c
 #     summary(): Computes and returns glucose summary metrics, including interday mean glucose, interday median glucose, interday minimum glucose, interday maximum glucose, interday first quartile glucose, and interday third quartile glucose
@@ -28,6 +27,12 @@ from statsmodels.nonparametric.smoothers_lowess import lowess
 #     GRI(): Computes the glucose risk index, a composite score for hypo- and hyperglycemia
 #     count_peaks(): Counts the number of glucose peaks above a given threshold
 #     TAT_revised(): Computes and returns a more precise time above threshold by considering episode durations
+#     glucose_episodes(): Computes peaks, episodes and time above/below for several thresholds in one pass
+#     glycemic_features(): Computes all daily window features in a single pass over a glucose array
+#     glycemic_features_batch(): Computes all daily window features for a matrix of windows, one window per row
+#     register_feature(): Adds a feature to the registry used by glycemic_features_batch
+#     day_slot_matrix(): Regularizes a subject's readings onto a (days x time-of-day slots) matrix
+#     interday_metrics(): Computes MODD, CONGA-n and interday/intraday SD and CV from a day x slot matrix
 
 def interdaycv(df):
     """
@@ -266,36 +271,45 @@ def DRR(df):
     return DRR
 
 
+def MODD(df, sr=5):
+    """
+        Computes and returns the mean of daily differences, the mean absolute difference between
+        each glucose value and the value at the same time of day on the previous day
+        Args:
+            (pd.DataFrame): dataframe of data with Time and Glucose columns
+            sr (integer): grid resolution in minutes (default=5)
+        Returns:
+            MODD (float): mean of daily differences
+            
+    """
+    matrix, _ = day_slot_matrix(df['Time'], df['Glucose'], sr=sr)
+    return interday_metrics(matrix, sr=sr, conga_hours=())['MODD']
+
+def CONGA(df, n=24, sr=5):
+    """
+        Computes and returns the continuous overall net glycemic action over n hours
+        Args:
+            (pd.DataFrame): dataframe of data with Time and Glucose columns
+            n (float): lag in hours (default=24)
+            sr (integer): grid resolution in minutes (default=5)
+        Returns:
+            CONGA (float): standard deviation of the differences between each glucose value
+                and the value n hours before
+            
+    """
+    matrix, _ = day_slot_matrix(df['Time'], df['Glucose'], sr=sr)
+    return interday_metrics(matrix, sr=sr, conga_hours=(n,))[f'CONGA{n}']
+
 def CONGA24(df):
     """
         Computes and returns the continuous overall net glycemic action over 24 hours
         Args:
-            (pd.DataFrame): dataframe of data with DateTime, Time and Glucose columns
-        Requires:
-            uniquevalfilter (function)
+            (pd.DataFrame): dataframe of data with Time and Glucose columns
         Returns:
             CONGA24 (float): continuous overall net glycemic action over 24 hours
             
     """
-    df['Timefrommidnight'] =  df['Time'].dt.time
-    lists=[]
-    for i in range(0, len(df['Timefrommidnight'])):
-        lists.append(int(df['Timefrommidnight'][i].strftime('%H:%M:%S')[0:2])*60 + int(df['Timefrommidnight'][i].strftime('%H:%M:%S')[3:5]) + round(int(df['Timefrommidnight'][i].strftime('%H:%M:%S')[6:9])/60))
-    df['Minfrommid'] = lists
-    df = df.drop(columns=['Timefrommidnight'])
-    
-    #Calculation of MODD and CONGA:
-    MODD_n = []
-    uniquetimes = df['Minfrommid'].unique()
-
-    for i in uniquetimes:
-        MODD_n.append(uniquevalfilter(df, i))
-    
-    #Remove zeros from dataframe for calculation (in case there are random unique values that result in a mean of 0)
-    MODD_n[MODD_n == 0] = np.nan
-    
-    CONGA24 = np.nanstd(MODD_n)
-    return CONGA24
+    return CONGA(df, n=24)
 
 def summary(df): 
     """
@@ -376,21 +390,8 @@ def count_peaks(df, threshold):
         Returns:
             peaks (int): the number of peaks (instances where glucose exceeds the threshold)
     """
-    peaks = 0
-    above_threshold = False
- 
-    for glucose_level in df['Glucose']:
-        if above_threshold:
-            if glucose_level < threshold:
-                peaks += 1
-                above_threshold = False
-        else:
-            if glucose_level > threshold:
-                above_threshold = True
-    if above_threshold:
-        peaks += 1
- 
-    return peaks
+    episodes = glucose_episodes_batch(df['Glucose'].to_numpy(dtype=float)[None, :], [threshold])
+    return int(episodes['peaks'][0, 0])
 
 def TAT_revised(df, thres):
     """
@@ -401,19 +402,447 @@ def TAT_revised(df, thres):
         Returns:
             TAT_thres (float): total time above the threshold (in minutes), taking into account the duration of each episode
     """
-    
-    # Add above_thres column
-    df['above_thres'] = df['Glucose'] > thres
+    episodes = glucose_episodes(df['Glucose'], [thres], time=df['Time'])
+    TAT_thres = float(episodes[thres]['durations'].sum())
 
-    # Identify episodes of above-140 levels
-    df['episode_id'] = (df['above_thres'] != df['above_thres'].shift()).cumsum()
+    return TAT_thres
 
-    # Calculate episode durations
-    df['duration'] = df.groupby('episode_id')['Time'].diff().fillna(pd.Timedelta(seconds=0))
+GLYCEMIC_FEATURE_NAMES = [
+    "mean", "median", "min", "max", "fq", "tq",
+    "interdaysd", "interdaycv", "TOR", "TIR", "MGE", "MGN", "J_index",
+    "LBGI", "HBGI", "ADRR", "TA140", "TA200", "TIR_70_180", "TA180",
+    "TA250", "TB70", "TB54", "TITR", "GRI", "PA140", "PA180", "PA200"
+]
+
+def _nan_percentiles(sorted_g, n, q):
+    """
+        Row-wise linear percentiles of an array sorted along axis 1 with NaNs last,
+        matching np.nanpercentile
+    """
+    rows = np.arange(sorted_g.shape[0])
+    out = np.full((sorted_g.shape[0], len(q)), np.nan)
+    has = n > 0
+    for j, qj in enumerate(q):
+        pos = (qj / 100.0)*(n[has] - 1)
+        lo = np.floor(pos).astype(int)
+        hi = np.minimum(lo + 1, n[has] - 1)
+        t = pos - lo
+        a = sorted_g[rows[has], lo]
+        b = sorted_g[rows[has], hi]
+        diff = b - a
+        out[has, j] = np.where(t >= 0.5, b - diff*(1 - t), a + diff*t)
+    return out
+
+def glucose_episodes_batch(glucose, thresholds, sr=5):
+    """
+        Run-length episode engine: computes peak counts, episodes above threshold and time
+        above/below threshold for many windows and thresholds in one vectorized pass
+        Args:
+            glucose (np.ndarray): (n_windows, n_slots) matrix of glucose values, NaN for missing samples
+            thresholds (list): glucose thresholds
+            sr (integer): sampling rate (default=5[minutes, once every 5 minutes glucose is recorded])
+        Returns:
+            episodes (dict): (n_windows, n_thresholds) arrays
+                peaks: peaks as in count_peaks (start above the threshold, end below it,
+                    missing samples keep the current state)
+                episodes: runs of consecutive samples above the threshold (missing samples end a run)
+                longest_episode: duration of the longest episode, units=minutes
+                time_above: time at or above the threshold as in TAT, units=minutes
+                time_below: time at or below the threshold as in TBT, units=minutes
+            
+    """
+    g = np.atleast_2d(np.asarray(glucose, dtype=float))
+    thresholds = np.asarray(thresholds, dtype=float)
+    n_windows, n_slots = g.shape
+    gt = g[:, None, :] > thresholds[None, :, None]
+    lt = g[:, None, :] < thresholds[None, :, None]
+
+    # Strict above-threshold runs from the edges of the padded indicator
+    edges = np.diff(np.pad(gt.astype(np.int8), ((0, 0), (0, 0), (1, 1))), axis=2)
+    run_window, run_threshold, run_start = np.nonzero(edges == 1)
+    run_end = np.nonzero(edges == -1)[2]
+    episodes = np.zeros((n_windows, len(thresholds)), dtype=int)
+    np.add.at(episodes, (run_window, run_threshold), 1)
+    longest = np.zeros((n_windows, len(thresholds)), dtype=int)
+    np.maximum.at(longest, (run_window, run_threshold), run_end - run_start)
+
+    # count_peaks hysteresis: the state is the last non-missing sample that is not on the threshold
+    signal = gt.astype(np.int8) - lt.astype(np.int8)
+    last = np.where(signal != 0, np.arange(n_slots), -1)
+    last = np.maximum.accumulate(last, axis=2)
+    state = np.take_along_axis(signal, np.maximum(last, 0), axis=2)
+    above = (last >= 0) & (state == 1)
+    peaks = above[:, :, 0].astype(int) + np.count_nonzero(above[:, :, 1:] & ~above[:, :, :-1], axis=2)
+
+    return {
+        'peaks': peaks,
+        'episodes': episodes,
+        'longest_episode': longest*sr,
+        'time_above': np.count_nonzero(g[:, None, :] >= thresholds[None, :, None], axis=2)*sr,
+        'time_below': np.count_nonzero(g[:, None, :] <= thresholds[None, :, None], axis=2)*sr,
+    }
+
+def glucose_episodes(glucose, thresholds, time=None, sr=5):
+    """
+        Episodes of a single window for every threshold, including the duration of each episode
+        Args:
+            glucose (array-like): glucose values, NaN for missing samples
+            thresholds (list): glucose thresholds
+            time (array-like): timestamps of the samples; if given, an episode lasts from its
+                first to its last sample as in TAT_revised, otherwise its length times sr
+            sr (integer): sampling rate (default=5[minutes, once every 5 minutes glucose is recorded])
+        Returns:
+            episodes (dict): for each threshold, a dict with peaks, episodes, longest_episode,
+                time_above and time_below (see glucose_episodes_batch) and durations, an array
+                with the duration of each episode, units=minutes
+            
+    """
+    g = np.asarray(glucose, dtype=float)
+    summary = glucose_episodes_batch(g[None, :], thresholds, sr=sr)
+    if time is not None:
+        ns = pd.to_datetime(pd.Series(time)).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+    episodes = {}
+    for j, threshold in enumerate(thresholds):
+        edges = np.diff(np.pad((g > threshold).astype(np.int8), 1))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        if time is None:
+            durations = (ends - starts)*float(sr)
+        else:
+            durations = (ns[ends - 1] - ns[starts]) / 60e9
+        episodes[threshold] = {name: value[0, j].item() for name, value in summary.items()}
+        episodes[threshold]['durations'] = durations
+        if time is not None:
+            episodes[threshold]['longest_episode'] = float(durations.max()) if len(durations) else 0.0
+    return episodes
 
-    # Filter and sum durations where glucose levels were above 140
-    total_duration_above_thres = df[df['above_thres']].groupby('episode_id')['duration'].sum()
+class _Node:
+    """
+        A registered feature or intermediate: compute(context) returns one value per window
+        (or any shared array for intermediates) and may read the nodes listed in requires
+    """
+    def __init__(self, name, compute, requires, integer, output):
+        self.name = name
+        self.compute = compute
+        self.requires = tuple(requires)
+        self.integer = integer
+        self.output = output
 
-    TAT_thres = float(total_duration_above_thres.dt.total_seconds().sum()/60)
+# Registered intermediates and features, by name
+INTERMEDIATES = {}
+FEATURES = {}
 
-    return TAT_thres
+# Version of the feature definitions; bump it when a registered feature's values change,
+# so that cached feature values (see feature_cache.FeatureCache) are recomputed
+FEATURES_VERSION = 1
+
+def register_intermediate(name, requires=()):
+    """
+        Decorator registering a shared intermediate, computed at most once per batch
+        Args:
+            name (str): intermediate name
+            requires (tuple): names of the intermediates or features it reads from the context
+    """
+    def register(compute):
+        INTERMEDIATES[name] = _Node(name, compute, requires, False, False)
+        return compute
+    return register
+
+def register_feature(name, requires=(), integer=False):
+    """
+        Decorator registering a window feature for glycemic_features_batch
+        Args:
+            name (str): feature (column) name
+            requires (tuple): names of the intermediates or features it reads from the context
+            integer (bool): whether the feature is a count returned as an integer
+    """
+    def register(compute):
+        FEATURES[name] = _Node(name, compute, requires, integer, True)
+        return compute
+    return register
+
+class FeatureContext:
+    """
+        Inputs of one batch (glucose, lengths, sr) and the values of computed nodes, by name
+    """
+    def __init__(self, glucose, lengths, sr):
+        self.glucose = glucose
+        self.lengths = lengths
+        self.sr = sr
+        self.values = {}
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+def required_nodes(features):
+    """
+        Returns the features and intermediates needed for the given features, in computation order
+    """
+    order = []
+    seen = set()
+
+    def visit(name):
+        if name in seen:
+            return
+        node = FEATURES.get(name) or INTERMEDIATES.get(name)
+        if node is None:
+            raise KeyError(f"unknown glycemic feature or intermediate: {name!r}")
+        seen.add(name)
+        for dependency in node.requires:
+            visit(dependency)
+        order.append(node)
+
+    for name in features:
+        visit(name)
+    return order
+
+# Sample tests behind the threshold-time features: name -> test on glucose values
+# (NaN fails every test). Shared with the prefix-sum, incremental and histogram engines
+THRESHOLD_TESTS = {
+    'TA140': lambda g: g >= 140,
+    'TA180': lambda g: g >= 180,
+    'TA200': lambda g: g >= 200,
+    'TA250': lambda g: g >= 250,
+    'TB70': lambda g: g <= 70,
+    'TB54': lambda g: g <= 54,
+    'TIR_70_180': lambda g: (g <= 180) & (g >= 70),
+    'TITR': lambda g: (g <= 140) & (g >= 70),
+}
+
+def glucose_risk(glucose):
+    """
+        Splits the LBGI/HBGI risk function of glucose values into its low and high parts
+        Args:
+            glucose (np.ndarray or float): glucose values, NaN for missing samples
+        Returns:
+            low, high (np.ndarray): risk of each value with f <= 0 and f > 0 respectively,
+            0 elsewhere (missing samples add zero risk to both)
+    """
+    f = (np.log(glucose)**1.084) - 5.381
+    risk = 22.77*(f**2)
+    return np.where(f <= 0, risk, 0.0), np.where(f > 0, risk, 0.0)
+
+def glucose_risk_index(TB54, TB70, TA250, TA180):
+    """
+        Glucose risk index (GRI) from the times below 54/70 and above 250/180 mg/dL, as in GRI
+    """
+    return (3.0*TB54)+(2.4*TB70)+(1.6*TA250)+(0.8*TA180)
+
+@register_intermediate('count')
+def _count(ctx):
+    return np.count_nonzero(~np.isnan(ctx.glucose), axis=1)
+
+@register_intermediate('moments', requires=('count',))
+def _moments(ctx):
+    g = ctx.glucose
+    valid = ~np.isnan(g)
+    meanG = np.where(valid, g, 0.0).sum(axis=1) / ctx['count']
+    sdG = np.sqrt((np.where(valid, g - meanG[:, None], 0.0)**2).sum(axis=1) / ctx['count'])
+    return meanG, sdG
+
+@register_intermediate('band', requires=('moments',))
+def _band(ctx):
+    # Samples inside and outside the mean +/- 1 SD band
+    meanG, sdG = ctx['moments']
+    up = (meanG + sdG)[:, None]
+    dw = (meanG - sdG)[:, None]
+    in_band = (ctx.glucose <= up) & (ctx.glucose >= dw)
+    out_band = (ctx.glucose >= up) | (ctx.glucose <= dw)
+    return in_band, out_band, np.count_nonzero(in_band, axis=1), np.count_nonzero(out_band, axis=1)
+
+@register_intermediate('risk')
+def _risk(ctx):
+    # Missing samples add zero risk but still count towards the mean, as in LBGI_HBGI
+    return glucose_risk(ctx.glucose)
+
+@register_intermediate('sorted')
+def _sorted(ctx):
+    return np.sort(ctx.glucose, axis=1)
+
+@register_intermediate('quartiles', requires=('sorted', 'count'))
+def _quartiles(ctx):
+    return _nan_percentiles(ctx['sorted'], ctx['count'], [25, 50, 75]).T
+
+@register_intermediate('peaks')
+def _peaks(ctx):
+    # One episode pass for the PA thresholds [140, 180, 200]
+    return glucose_episodes_batch(ctx.glucose, [140, 180, 200], sr=ctx.sr)['peaks'].T
+
+register_feature('mean', requires=('moments',))(lambda ctx: ctx['moments'][0])
+register_feature('median', requires=('quartiles',))(lambda ctx: ctx['quartiles'][1])
+register_feature('min', requires=('sorted', 'count'))(
+    lambda ctx: np.where(ctx['count'] > 0, ctx['sorted'][:, 0], np.nan))
+register_feature('max', requires=('sorted', 'count'))(
+    lambda ctx: np.where(ctx['count'] > 0,
+                         ctx['sorted'][np.arange(len(ctx['count'])), np.maximum(ctx['count'] - 1, 0)], np.nan))
+register_feature('fq', requires=('quartiles',))(lambda ctx: ctx['quartiles'][0])
+register_feature('tq', requires=('quartiles',))(lambda ctx: ctx['quartiles'][2])
+register_feature('interdaysd', requires=('moments',))(lambda ctx: ctx['moments'][1])
+register_feature('interdaycv', requires=('moments',))(lambda ctx: (ctx['moments'][1] / ctx['moments'][0])*100)
+register_feature('TOR', requires=('band',), integer=True)(lambda ctx: ctx['band'][3]*ctx.sr)
+register_feature('TIR', requires=('band',), integer=True)(lambda ctx: ctx['band'][2]*ctx.sr)
+register_feature('MGE', requires=('band',))(
+    lambda ctx: np.where(ctx['band'][3] > 0, np.where(ctx['band'][1], ctx.glucose, 0.0).sum(axis=1) / ctx['band'][3], np.nan))
+register_feature('MGN', requires=('band',))(
+    lambda ctx: np.where(ctx['band'][2] > 0, np.where(ctx['band'][0], ctx.glucose, 0.0).sum(axis=1) / ctx['band'][2], np.nan))
+register_feature('J_index', requires=('moments',))(lambda ctx: 0.001*((ctx['moments'][0] + ctx['moments'][1])**2))
+register_feature('LBGI', requires=('risk',))(lambda ctx: ctx['risk'][0].sum(axis=1) / ctx.lengths)
+register_feature('HBGI', requires=('risk',))(lambda ctx: ctx['risk'][1].sum(axis=1) / ctx.lengths)
+register_feature('ADRR', requires=('risk',))(
+    lambda ctx: ctx['risk'][0].max(axis=1, initial=0.0) + ctx['risk'][1].max(axis=1, initial=0.0))
+for _name, _test in THRESHOLD_TESTS.items():
+    register_feature(_name, integer=True)(
+        lambda ctx, test=_test: np.count_nonzero(test(ctx.glucose), axis=1)*ctx.sr)
+register_feature('GRI', requires=('TA180', 'TA250', 'TB70', 'TB54'))(
+    lambda ctx: glucose_risk_index(ctx['TB54'], ctx['TB70'], ctx['TA250'], ctx['TA180']))
+for _position, _threshold in enumerate((140, 180, 200)):
+    register_feature(f'PA{_threshold}', requires=('peaks',), integer=True)(
+        lambda ctx, position=_position: ctx['peaks'][position])
+
+# Features that are counts of samples (times sr) and are returned as integers
+INTEGER_FEATURES = [name for name in GLYCEMIC_FEATURE_NAMES if FEATURES[name].integer]
+
+def glycemic_features_batch(glucose, lengths=None, sr=5, profiler=None, features=None):
+    """
+        Computes daily window features for many windows at once, one window per row. Only the
+        intermediates required by the requested features are computed, each once.
+        Args:
+            glucose (np.ndarray): (n_windows, n_slots) matrix of glucose values on a regular
+                sr-minute grid, NaN for missing samples and for padding
+            lengths (array-like): number of grid slots that belong to each window; slots past a
+                window's length must be NaN (default=n_slots for every window)
+            sr (integer): sampling rate (default=5[minutes, once every 5 minutes glucose is recorded])
+            profiler (profiling.Profiler): records time per node as intermediate.<name> and feature.<name>
+            features (list): names of registered features (default=GLYCEMIC_FEATURE_NAMES)
+        Returns:
+            features (np.ndarray): (n_windows, n_features) feature matrix with columns in the
+                order of the requested features
+            
+    """
+    g = np.atleast_2d(np.asarray(glucose, dtype=float))
+    n_windows, n_slots = g.shape
+    if lengths is None:
+        lengths = np.full(n_windows, n_slots)
+    features = list(GLYCEMIC_FEATURE_NAMES if features is None else features)
+    profiler = profiler or NULL_PROFILER
+    ctx = FeatureContext(g, np.asarray(lengths, dtype=float), sr)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for node in required_nodes(features):
+            with profiler.stage(('feature.' if node.output else 'intermediate.') + node.name):
+                ctx.values[node.name] = node.compute(ctx)
+
+    if not features:
+        return np.empty((n_windows, 0))
+    return np.column_stack([ctx[name] for name in features]).astype(float)
+
+def glycemic_features(glucose, sr=5, profiler=None, features=None):
+    """
+        Computes daily window features of a single window, sharing the mean/SD band,
+        the risk transform and the threshold counts between features
+        Args:
+            glucose (array-like): glucose values of one window, NaN for missing samples
+            sr (integer): sampling rate (default=5[minutes, once every 5 minutes glucose is recorded])
+            profiler (profiling.Profiler): records time per node as intermediate.<name> and feature.<name>
+            features (list): names of registered features (default=GLYCEMIC_FEATURE_NAMES)
+        Returns:
+            features (dict): the features returned by summary, interdaysd, interdaycv, TOR, TIR,
+                MGE, MGN, J_index, LBGI, HBGI, DRR, TAT, TIR_lo_hi, TBT, GRI and count_peaks,
+                with the same values and in the order of the requested features
+            
+    """
+    features = list(GLYCEMIC_FEATURE_NAMES if features is None else features)
+    row = glycemic_features_batch(np.asarray(glucose, dtype=float)[None, :], sr=sr, profiler=profiler,
+                                  features=features)[0]
+    values = dict(zip(features, row))
+    for name in features:
+        if FEATURES[name].integer:
+            values[name] = int(values[name])
+    return values
+
+SUBJECT_FEATURE_NAMES = [
+    "MODD", "CONGA1", "CONGA2", "CONGA4", "CONGA24",
+    "interday_sd", "interday_cv", "intraday_sd", "intraday_cv"
+]
+
+def day_slot_matrix(time, glucose, sr=5):
+    """
+        Regularizes readings onto a calendar-day by time-of-day grid. Every slot holds the median
+        of the readings falling in it; days without readings inside the covered range are kept as
+        rows of NaN, so a lag of k slots is always k*sr minutes
+        Args:
+            time (array-like): timestamps of the readings
+            glucose (array-like): glucose values, NaN for missing samples
+            sr (integer): slot length in minutes, a divisor of 1440 (default=5)
+        Returns:
+            matrix (np.ndarray): (n_days, 1440/sr) matrix of glucose values, NaN for empty slots
+            days (np.ndarray): datetime64[D] date of each row
+            
+    """
+    t = pd.to_datetime(pd.Series(time)).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    g = np.asarray(glucose, dtype=float)
+    keep = ~np.isnan(g)
+    t, g = t[keep], g[keep]
+    day_ns = pd.Timedelta(days=1).value
+    n_slots = 1440 // sr
+    if len(t) == 0:
+        return np.empty((0, n_slots)), np.empty(0, dtype='datetime64[D]')
+
+    day = t // day_ns
+    first = day.min()
+    cell = (day - first)*n_slots + (t - day*day_ns) // pd.Timedelta(minutes=sr).value
+    n_days = int(day.max() - first) + 1
+    matrix = np.full(n_days*n_slots, np.nan)
+    medians = pd.Series(g).groupby(cell).median()
+    matrix[medians.index.to_numpy()] = medians.to_numpy()
+    days = np.arange(first, first + n_days).astype('datetime64[D]')
+    return matrix.reshape(n_days, n_slots), days
+
+def _nan_mean_std(x, axis=None):
+    """
+        Mean and population standard deviation ignoring NaN, NaN where nothing is observed
+    """
+    valid = ~np.isnan(x)
+    n = valid.sum(axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, x, 0.0).sum(axis=axis) / n
+        centered = np.where(valid, x - (mean if axis is None else np.expand_dims(mean, axis)), 0.0)
+        std = np.sqrt((centered**2).sum(axis=axis) / n)
+    return mean, std
+
+def interday_metrics(matrix, sr=5, conga_hours=(1, 2, 4, 24)):
+    """
+        Computes the multi-day variability metrics of one subject with lag arithmetic on a day x
+        slot matrix; pairs involving a missing slot are skipped
+        Args:
+            matrix (np.ndarray): (n_days, n_slots) glucose matrix, e.g. from day_slot_matrix
+            sr (integer): slot length in minutes (default=5)
+            conga_hours (tuple): lags in hours for CONGA-n (default=(1, 2, 4, 24))
+        Returns:
+            metrics (dict): MODD (mean absolute difference to the same slot on the previous day),
+                CONGA<n> (SD of differences to the value n hours before), interday_sd and
+                interday_cv (SD and CV of the daily means), intraday_sd and intraday_cv (mean over
+                days of the within-day SD and CV); NaN when there is nothing to compare
+            
+    """
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=float))
+    flat = matrix.ravel()
+    metrics = {}
+
+    daily = np.abs(matrix[1:] - matrix[:-1])
+    metrics['MODD'] = _nan_mean_std(daily)[0]
+
+    for n in conga_hours:
+        lag = int(round(n*60 / sr))
+        diff = flat[lag:] - flat[:-lag] if 0 < lag < len(flat) else np.empty(0)
+        metrics[f'CONGA{n}'] = _nan_mean_std(diff)[1]
+
+    day_mean, day_sd = _nan_mean_std(matrix, axis=1)
+    observed = ~np.isnan(day_mean)
+    between_mean, between_sd = _nan_mean_std(day_mean[observed])
+    metrics['interday_sd'] = between_sd
+    metrics['interday_cv'] = (between_sd / between_mean)*100
+    metrics['intraday_sd'] = _nan_mean_std(day_sd[observed])[0]
+    metrics['intraday_cv'] = _nan_mean_std((day_sd / day_mean*100)[observed])[0]
+    return {name: float(value) for name, value in metrics.items()}
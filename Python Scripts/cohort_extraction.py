@@ -0,0 +1,358 @@
+## Cohort-level daily window extraction over a process pool
+import argparse
+import heapq
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import CGM_TAML as taml
+import cgmquantify_stuart as cgm
+from profiling import Profiler
+from cgm_io import CohortStore, FeatureTableWriter, iter_feature_partitions, iter_subjects_csv, read_cgm_csv
+from feature_cache import FeatureCache
+
+
+def balanced_chunks(sizes, n_chunks):
+    """
+    Split items into chunks of similar total size (longest-processing-time first).
+
+    Parameters:
+    - sizes: sequence of int, the cost of each item (e.g. number of readings).
+    - n_chunks: int, the number of chunks to build.
+
+    Returns:
+    - chunks: list of lists of item positions; empty chunks are dropped and the
+      positions inside each chunk are in ascending order.
+    """
+    sizes = np.asarray(sizes)
+    n_chunks = max(1, min(int(n_chunks), len(sizes)))
+    heap = [(0, chunk) for chunk in range(n_chunks)]
+    chunks = [[] for _ in range(n_chunks)]
+    # Stable sort keeps the assignment deterministic for equal sizes
+    for position in np.argsort(-sizes, kind='stable'):
+        load, chunk = heapq.heappop(heap)
+        chunks[chunk].append(int(position))
+        heapq.heappush(heap, (load + int(sizes[position]), chunk))
+    return [sorted(chunk) for chunk in chunks if chunk]
+
+
+def _extract_chunk(subjects, options, profile):
+    # Runs in a worker process: featurize every subject of one chunk.
+    # options are keyword arguments of feature_extraction_fixed_hour_window_0oclock.
+    profiler = Profiler() if profile else None
+    results = []
+    for position, id, subject_df in subjects:
+        feature_table = taml.feature_extraction_fixed_hour_window_0oclock(subject_df, id, profiler=profiler, **options)
+        results.append((position, id, feature_table))
+    return results, profiler.report() if profile else None
+
+
+def _extract_store_chunk(store, positions, options, profile):
+    # Runs in a worker process: the store arrives as a path and is memory-mapped here
+    subjects = [(position, store.ids[position], store.subject(store.ids[position])) for position in positions]
+    return _extract_chunk(subjects, options, profile)
+
+
+def _gather(results, profiler, chunk_output, writer=None):
+    # Merge one chunk's (results, profile report) into the running totals; with a writer,
+    # feature tables are checkpointed with their input positions instead of kept in memory
+    chunk_results, report = chunk_output
+    if writer is None:
+        results.extend(chunk_results)
+    else:
+        for position, id, feature_table in chunk_results:
+            writer.write(id, feature_table, position=position)
+    if report is not None:
+        profiler.merge(report)
+
+
+def _open_writer(output):
+    if output is None or isinstance(output, FeatureTableWriter):
+        return output
+    return FeatureTableWriter(output)
+
+
+def extract_cohort(df, hour=24, one_per_midnight=False, n_workers=None, chunks_per_worker=4, verbose=False,
+                   profile=False, features=None, subject_features=False, output=None, cache=None):
+    """
+    Compute the daily window feature table of every subject in a cohort, sharding
+    subjects across a process pool.
+
+    Parameters:
+    - df: pandas DataFrame with ID, Glucose and Time columns.
+    - hour: int, the window length in hours passed to feature_extraction_fixed_hour_window_0oclock.
+    - one_per_midnight: bool, keep only one window anchor per calendar midnight.
+    - n_workers: int, the number of worker processes (default: os.cpu_count()); 1 runs in-process.
+    - chunks_per_worker: int, chunks per worker; chunks are balanced by reading count.
+    - verbose: bool, print a throughput summary.
+    - profile: bool, collect per-stage and per-feature timings and window counters in every
+      worker (see profiling.Profiler) and merge them into stats['profile'].
+    - features: list of str, the registered feature names to compute (default: all of
+      cgmquantify_stuart.GLYCEMIC_FEATURE_NAMES); only their intermediates are computed.
+    - subject_features: bool, add each subject's multi-day metrics (MODD, CONGA-n, interday and
+      intraday SD/CV, see cgmquantify_stuart.SUBJECT_FEATURE_NAMES) to its window rows.
+    - output: str or cgm_io.FeatureTableWriter, a checkpoint directory. Finished subjects
+      are written there as they complete instead of being kept in memory, and subjects
+      already recorded in its manifest are skipped, so an interrupted run can be resumed.
+    - cache: feature_cache.FeatureCache; windows found in it are not featurized again. Give
+      it a directory to share it between workers and runs; its hits and misses are counted
+      in the cache_hits and cache_misses profile counters.
+
+    Returns:
+    - feature_table: pandas DataFrame with one row per window, subjects in order of
+      first appearance in df; None when output is given (see cgm_io.read_feature_table).
+    - stats: dict with n_subjects, n_readings, n_windows, n_skipped, seconds and
+      subject_days_per_sec, plus profile when requested.
+    """
+    start = time.perf_counter()
+    n_workers = n_workers or os.cpu_count() or 1
+    writer = _open_writer(output)
+    groups = df.groupby('ID', sort=False)
+    ids = list(groups.groups.keys())
+    # Positions index all subjects, so a resumed run keeps first-appearance order
+    positions = np.arange(len(ids))
+    if writer is not None:
+        positions = np.array([position for position in positions if str(ids[position]) not in writer.done], dtype=int)
+    sizes = groups.size().reindex(ids).to_numpy()[positions]
+
+    chunks = [[int(positions[i]) for i in chunk] for chunk in balanced_chunks(sizes, n_workers * chunks_per_worker)]
+    tasks = [
+        [(position, ids[position], groups.get_group(ids[position])) for position in chunk]
+        for chunk in chunks
+    ]
+
+    options = {'hour': hour, 'one_per_midnight': one_per_midnight, 'features': features,
+               'subject_features': subject_features, 'cache': cache}
+    results, profiler = [], Profiler()
+    if n_workers == 1:
+        for task in tasks:
+            _gather(results, profiler, _extract_chunk(task, options, profile), writer)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_extract_chunk, task, options, profile) for task in tasks]
+            for future in futures:
+                _gather(results, profiler, future.result(), writer)
+
+    # Deterministic output order regardless of chunking and completion order
+    results.sort(key=lambda result: result[0])
+    return _collect(results, len(positions), int(sizes.sum()), start, n_workers, options, verbose,
+                    profiler if profile else None, writer, len(ids) - len(positions))
+
+
+def extract_subjects(subjects, hour=24, one_per_midnight=False, n_workers=None, task_readings=200_000, verbose=False,
+                     profile=False, features=None, subject_features=False, output=None, cache=None):
+    """
+    Streaming variant of extract_cohort for an iterable of subjects, e.g. iter_subjects_csv.
+
+    Subjects are grouped into tasks of about task_readings readings and at most two tasks
+    per worker are in flight, so memory is bounded by the in-flight subjects rather than
+    by the cohort.
+
+    Parameters:
+    - subjects: iterable of (id, df) pairs, df with ID, Glucose and Time columns.
+    - hour: int, the window length in hours passed to feature_extraction_fixed_hour_window_0oclock.
+    - one_per_midnight: bool, keep only one window anchor per calendar midnight.
+    - n_workers: int, the number of worker processes (default: os.cpu_count()); 1 runs in-process.
+    - task_readings: int, the approximate number of readings sent to a worker per task.
+    - verbose, profile, features, subject_features, output, cache: as for extract_cohort.
+
+    Returns:
+    - feature_table: pandas DataFrame with one row per window, subjects in input order,
+      or None when output is given.
+    - stats: as for extract_cohort.
+    """
+    start = time.perf_counter()
+    n_workers = n_workers or os.cpu_count() or 1
+    writer = _open_writer(output)
+    n_skipped = 0
+
+    def tasks():
+        nonlocal n_skipped
+        task, task_size = [], 0
+        for position, (id, subject_df) in enumerate(subjects):
+            if writer is not None and str(id) in writer.done:
+                n_skipped += 1
+                continue
+            task.append((position, id, subject_df))
+            task_size += len(subject_df)
+            if task_size >= task_readings:
+                yield task, task_size
+                task, task_size = [], 0
+        if task:
+            yield task, task_size
+
+    options = {'hour': hour, 'one_per_midnight': one_per_midnight, 'features': features,
+               'subject_features': subject_features, 'cache': cache}
+    results, profiler = [], Profiler()
+    n_subjects = n_readings = 0
+    if n_workers == 1:
+        for task, task_size in tasks():
+            _gather(results, profiler, _extract_chunk(task, options, profile), writer)
+            n_subjects += len(task)
+            n_readings += task_size
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            in_flight = deque()
+            for task, task_size in tasks():
+                in_flight.append(executor.submit(_extract_chunk, task, options, profile))
+                n_subjects += len(task)
+                n_readings += task_size
+                # Tasks complete in submission order, which keeps the output in input order
+                while len(in_flight) >= 2 * n_workers:
+                    _gather(results, profiler, in_flight.popleft().result(), writer)
+            while in_flight:
+                _gather(results, profiler, in_flight.popleft().result(), writer)
+
+    return _collect(results, n_subjects, n_readings, start, n_workers, options, verbose,
+                    profiler if profile else None, writer, n_skipped)
+
+
+def extract_store(store, hour=24, one_per_midnight=False, n_workers=None, chunks_per_worker=4, verbose=False,
+                  profile=False, features=None, subject_features=False, output=None, cache=None):
+    """
+    Variant of extract_cohort reading from a cohort store written by cgm_io.write_cohort_store.
+
+    Workers receive only the store path and subject positions and memory-map the
+    subjects themselves, so nothing is parsed or pickled per subject.
+
+    Parameters:
+    - store: CohortStore or str, the store or its directory.
+    - hour, one_per_midnight, n_workers, chunks_per_worker, verbose, profile, features, subject_features,
+      output, cache: as for extract_cohort.
+
+    Returns:
+    - feature_table: pandas DataFrame with one row per window, subjects in store order,
+      or None when output is given.
+    - stats: as for extract_cohort.
+    """
+    start = time.perf_counter()
+    n_workers = n_workers or os.cpu_count() or 1
+    if not isinstance(store, CohortStore):
+        store = CohortStore(store)
+    writer = _open_writer(output)
+    positions = np.arange(len(store))
+    if writer is not None:
+        positions = np.array([position for position in positions if store.ids[position] not in writer.done], dtype=int)
+    sizes = store.sizes[positions]
+
+    chunks = [[int(positions[i]) for i in chunk] for chunk in balanced_chunks(sizes, n_workers * chunks_per_worker)]
+    options = {'hour': hour, 'one_per_midnight': one_per_midnight, 'features': features,
+               'subject_features': subject_features, 'cache': cache}
+    results, profiler = [], Profiler()
+    if n_workers == 1:
+        for chunk in chunks:
+            _gather(results, profiler, _extract_store_chunk(store, chunk, options, profile), writer)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_extract_store_chunk, store, chunk, options, profile) for chunk in chunks]
+            for future in futures:
+                _gather(results, profiler, future.result(), writer)
+
+    results.sort(key=lambda result: result[0])
+    return _collect(results, len(positions), int(sizes.sum()), start, n_workers, options, verbose,
+                    profiler if profile else None, writer, len(store) - len(positions))
+
+
+def _collect(results, n_subjects, n_readings, start, n_workers, options, verbose, profiler=None, writer=None,
+             n_skipped=0):
+    # Concatenate ordered per-subject tables (or finish the checkpoint) and report throughput
+    tables = [feature_table for _, _, feature_table in results if len(feature_table)]
+    if writer is not None:
+        writer.close()
+        feature_table = None
+        n_windows = writer.rows_written
+    elif tables:
+        feature_table = pd.concat(tables, ignore_index=True)
+    else:
+        empty = pd.DataFrame({'ID': pd.Series(dtype=str), 'Glucose': pd.Series(dtype=float),
+                              'Time': pd.Series(dtype='datetime64[ns]')})
+        feature_table = taml.feature_extraction_fixed_hour_window_0oclock(empty, None, **options)
+    if writer is None:
+        n_windows = len(feature_table)
+
+    seconds = time.perf_counter() - start
+    stats = {
+        'n_subjects': n_subjects,
+        'n_readings': n_readings,
+        'n_windows': n_windows,
+        'n_skipped': n_skipped,
+        'seconds': seconds,
+        'subject_days_per_sec': n_windows / seconds if seconds > 0 else float('inf'),
+    }
+    if profiler is not None:
+        stats['profile'] = profiler.report()
+    if verbose:
+        print(
+            f"{stats['n_subjects']} subjects, {stats['n_windows']} subject-days in {seconds:.1f}s "
+            f"({stats['subject_days_per_sec']:.1f} subject-days/sec, {n_workers} workers)"
+        )
+        if n_skipped:
+            print(f"  {n_skipped} subjects already checkpointed, skipped")
+        if profiler is not None:
+            for name, stage in stats['profile']['stages'].items():
+                print(f"  {name}: {stage['seconds']:.2f}s in {stage['calls']} calls")
+            for name, n in stats['profile']['counters'].items():
+                print(f"  {name}: {n}")
+    return feature_table, stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract daily glycemic features for a CGM cohort.")
+    parser.add_argument("input", help="CSV with id, gl and time columns, or a cohort store directory")
+    parser.add_argument("output", help="CSV file for the feature table")
+    parser.add_argument("--hour", type=int, default=24, help="window length in hours (default: 24)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--chunks-per-worker", type=int, default=4, help="load-balancing chunks per worker")
+    parser.add_argument("--one-per-midnight", action="store_true", help="keep one window anchor per midnight")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="stream the input this many CSV rows at a time instead of loading it whole")
+    parser.add_argument("--profile", action="store_true", help="print per-stage and per-feature timings")
+    parser.add_argument("--features", default=None,
+                        help="comma-separated feature names to compute (default: all features)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="directory for resumable partitioned output; rerun the same command to resume")
+    parser.add_argument("--subject-features", action="store_true",
+                        help="add per-subject MODD, CONGA-n and interday/intraday SD and CV columns")
+    parser.add_argument("--cache", default=None,
+                        help="feature cache directory reused across runs; only new or changed windows are featurized")
+    args = parser.parse_args(argv)
+    features = args.features.split(",") if args.features else None
+    unknown = [name for name in features or [] if name not in cgm.FEATURES]
+    if unknown:
+        parser.error(f"unknown features: {', '.join(unknown)}")
+    cache = FeatureCache(args.cache) if args.cache else None
+
+    if os.path.isdir(args.input):
+        feature_table, _ = extract_store(
+            args.input, hour=args.hour, one_per_midnight=args.one_per_midnight,
+            n_workers=args.workers, chunks_per_worker=args.chunks_per_worker, verbose=True, profile=args.profile,
+            features=features, subject_features=args.subject_features, output=args.checkpoint, cache=cache,
+        )
+    elif args.chunksize:
+        feature_table, _ = extract_subjects(
+            iter_subjects_csv(args.input, chunksize=args.chunksize), hour=args.hour,
+            one_per_midnight=args.one_per_midnight, n_workers=args.workers, verbose=True, profile=args.profile,
+            features=features, subject_features=args.subject_features, output=args.checkpoint, cache=cache,
+        )
+    else:
+        df = read_cgm_csv(args.input)
+        feature_table, _ = extract_cohort(
+            df, hour=args.hour, one_per_midnight=args.one_per_midnight,
+            n_workers=args.workers, chunks_per_worker=args.chunks_per_worker, verbose=True, profile=args.profile,
+            features=features, subject_features=args.subject_features, output=args.checkpoint, cache=cache,
+        )
+    if args.checkpoint is None:
+        feature_table.to_csv(args.output, index=False)
+    else:
+        # Assemble the CSV one partition at a time
+        with open(args.output, "w", newline="") as output_file:
+            for number, partition in enumerate(iter_feature_partitions(args.checkpoint)):
+                partition.to_csv(output_file, index=False, header=number == 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+## Content-addressed cache of per-window feature values: in-memory LRU over an on-disk store
+import hashlib
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import cgmquantify_stuart as cgm
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,
+                                    used REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta VALUES ('bytes', 0);
+"""
+
+# Keys per SQL statement, below SQLite's limit on bound parameters
+_BATCH = 500
+
+
+class FeatureCache:
+    """
+    Cache of window feature values keyed on the window's content.
+
+    A window's key hashes its regularized 5-minute glucose values, its length, the
+    sampling rate, the requested feature names and cgm.FEATURES_VERSION, so reruns over
+    the same windows skip featurization while changed windows, settings or feature
+    definitions miss. Values live in an in-memory LRU of max_entries windows and, with a
+    directory, in an SQLite store (features.sqlite) shared by processes; the store evicts
+    its least recently used windows once it holds more than max_bytes. Recency on disk is
+    updated by disk hits only, not by hits served from memory.
+
+    The cache pickles as its settings, so it can be passed to worker processes; each
+    worker gets an empty LRU and its own connection to the store.
+
+    Parameters:
+    - directory: str, the on-disk store directory (default: memory only).
+    - max_entries: int, the windows kept in memory.
+    - max_bytes: int, the on-disk store size (keys and values) above which it is evicted
+      down to 90%.
+
+    Attributes:
+    - hits, disk_hits, misses, evictions: int counters since creation (hits includes disk_hits).
+    """
+
+    def __init__(self, directory=None, max_entries=100_000, max_bytes=2**30):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._connection = None
+
+    def __getstate__(self):
+        return {'directory': self.directory, 'max_entries': self.max_entries, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def connection(self):
+        if self._connection is None and self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._connection = sqlite3.connect(os.path.join(self.directory, 'features.sqlite'), timeout=60)
+            self._connection.executescript(_SCHEMA)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def window_keys(self, glucose, lengths=None, sr=5, features=None):
+        """
+        Content keys of the windows of a (n_windows x n_slots) glucose matrix.
+
+        Parameters:
+        - glucose: numpy array of shape (n_windows, n_slots), NaN for missing samples and padding.
+        - lengths: array-like of shape (n_windows,), the slots belonging to each window
+          (default: n_slots for every window).
+        - sr: int, the sampling rate in minutes.
+        - features: list of str, the feature names (default: cgm.GLYCEMIC_FEATURE_NAMES).
+
+        Returns:
+        - keys: list of 16-byte keys, one per window.
+        """
+        glucose = np.atleast_2d(np.asarray(glucose, dtype=np.float64))
+        lengths = np.full(len(glucose), glucose.shape[1]) if lengths is None else np.asarray(lengths)
+        features = list(cgm.GLYCEMIC_FEATURE_NAMES if features is None else features)
+        context = hashlib.blake2b(digest_size=16)
+        context.update(repr((cgm.FEATURES_VERSION, sr, features)).encode())
+        keys = []
+        for row, length in zip(glucose, lengths):
+            digest = context.copy()
+            digest.update(int(length).to_bytes(8, 'little'))
+            digest.update(np.ascontiguousarray(row[:length]).tobytes())
+            keys.append(digest.digest())
+        return keys
+
+    def get_many(self, keys, n_features):
+        """
+        Look up windows by key.
+
+        Returns:
+        - values: numpy array of shape (n_keys, n_features), NaN rows for misses.
+        - found: boolean numpy array of shape (n_keys,).
+        """
+        values = np.full((len(keys), n_features), np.nan)
+        found = np.zeros(len(keys), dtype=bool)
+        on_disk = []
+        for position, key in enumerate(keys):
+            row = self.memory.get(key)
+            if row is not None:
+                self.memory.move_to_end(key)
+                values[position] = row
+                found[position] = True
+            else:
+                on_disk.append(position)
+
+        if on_disk and self.connection is not None:
+            rows = {}
+            for start in range(0, len(on_disk), _BATCH):
+                batch = [keys[position] for position in on_disk[start:start + _BATCH]]
+                query = f"SELECT key, value FROM entries WHERE key IN ({','.join('?' * len(batch))})"
+                rows.update(self.connection.execute(query, batch).fetchall())
+            if rows:
+                with self.connection:
+                    self.connection.executemany("UPDATE entries SET used = ? WHERE key = ?",
+                                                [(time.time(), key) for key in rows])
+            for position in on_disk:
+                value = rows.get(keys[position])
+                if value is not None:
+                    row = np.frombuffer(value, dtype=np.float64)
+                    values[position] = row
+                    found[position] = True
+                    self._remember(keys[position], row)
+            self.disk_hits += len(rows)
+
+        self.hits += int(found.sum())
+        self.misses += len(keys) - int(found.sum())
+        return values, found
+
+    def put_many(self, keys, values):
+        """
+        Store the feature values of windows, a row of values per key.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        for key, row in zip(keys, values):
+            self._remember(key, row.copy())
+        if self.connection is None or not len(keys):
+            return
+        now = time.time()
+        size = len(keys[0]) + values.shape[1]*8
+        with self.connection:
+            cursor = self.connection.executemany(
+                "INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?)",
+                [(key, row.tobytes(), size, now) for key, row in zip(keys, values)]
+            )
+            self.connection.execute("UPDATE meta SET value = value + ? WHERE name = 'bytes'",
+                                    (cursor.rowcount*size,))
+        self._evict()
+
+    def _remember(self, key, row):
+        self.memory[key] = row
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self):
+        # Drop the least recently used windows until the store is at 90% of max_bytes
+        with self.connection:
+            total = self.connection.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            excess = total - int(self.max_bytes*0.9)
+            removed, freed = [], 0
+            for key, size in self.connection.execute("SELECT key, size FROM entries ORDER BY used"):
+                if freed >= excess:
+                    break
+                removed.append((key,))
+                freed += size
+            self.connection.executemany("DELETE FROM entries WHERE key = ?", removed)
+            self.connection.execute("UPDATE meta SET value = value - ? WHERE name = 'bytes'", (freed,))
+        self.evictions += len(removed)
+
+    def stats(self):
+        """
+        Returns:
+        - stats: dict with hits, disk_hits, misses, hit_rate, evictions, memory_entries and,
+          with a directory, disk_entries and disk_bytes.
+        """
+        lookups = self.hits + self.misses
+        stats = {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'memory_entries': len(self.memory),
+        }
+        if self.connection is not None:
+            stats['disk_entries'] = self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            stats['disk_bytes'] = self.connection.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()[0]
+        return stats
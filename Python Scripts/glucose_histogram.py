@@ -0,0 +1,185 @@
+## Integer-glucose histograms of CGM windows: order-free features and additive aggregates
+import numpy as np
+import pandas as pd
+
+import CGM_TAML as taml
+import cgmquantify_stuart as cgm
+
+# Sensor range in mg/dL; one bin per integer value plus a trailing column of missing slots
+GLUCOSE_MIN = 39
+GLUCOSE_MAX = 401
+N_BINS = GLUCOSE_MAX - GLUCOSE_MIN + 1
+MISSING = N_BINS
+BIN_VALUES = np.arange(GLUCOSE_MIN, GLUCOSE_MAX + 1, dtype=float)
+
+# Per-bin lookup tables of the LBGI/HBGI risk function
+RISK_LOW, RISK_HIGH = cgm.glucose_risk(BIN_VALUES)
+
+# Features that depend only on the value distribution (every feature except the PA peak counts)
+HISTOGRAM_FEATURE_NAMES = [name for name in cgm.GLYCEMIC_FEATURE_NAMES if not name.startswith('PA')]
+
+
+def glucose_histograms(glucose, lengths=None, dtype=np.int32):
+    """
+    Histograms of a (n_windows x n_slots) glucose matrix, one row per window.
+
+    Values are rounded to integer mg/dL and clipped to the sensor range, so features
+    computed from the histograms match cgm.glycemic_features_batch exactly for integer
+    readings inside 39-401 mg/dL. Missing slots within a window's length are counted in
+    the MISSING column, which keeps LBGI/HBGI on the full-window denominator.
+
+    Parameters:
+    - glucose: numpy array of shape (n_windows, n_slots), NaN for missing samples and padding.
+    - lengths: array-like of shape (n_windows,), the slots belonging to each window
+      (default: n_slots for every window).
+    - dtype: the integer dtype of the counts.
+
+    Returns:
+    - histograms: numpy array of shape (n_windows, N_BINS + 1).
+    """
+    g = np.atleast_2d(np.asarray(glucose, dtype=float))
+    n_windows, n_slots = g.shape
+    lengths = np.full(n_windows, n_slots) if lengths is None else np.asarray(lengths)
+
+    rows, slots = np.nonzero(~np.isnan(g))
+    bins = np.clip(np.rint(g[rows, slots]), GLUCOSE_MIN, GLUCOSE_MAX).astype(np.int64) - GLUCOSE_MIN
+    counts = np.bincount(rows*(N_BINS + 1) + bins, minlength=n_windows*(N_BINS + 1))
+    histograms = counts.reshape(n_windows, N_BINS + 1)
+    histograms[:, MISSING] = lengths - histograms[:, :N_BINS].sum(axis=1)
+    return histograms.astype(dtype)
+
+
+def window_histograms(df, id, hour=24, one_per_midnight=False, **grid_options):
+    """
+    Histograms of the daily windows of one subject, see CGM_TAML.daily_glucose_windows.
+
+    Parameters:
+    - df: pandas DataFrame with Glucose and Time columns for one subject.
+    - id: the subject id.
+    - hour, one_per_midnight: the window settings.
+    - **grid_options: fill and max_gap, see CGM_TAML.regularize_glucose.
+
+    Returns:
+    - window_ids: numpy array of window ids.
+    - histograms: numpy array of shape (n_windows, N_BINS + 1).
+    """
+    window_ids, glucose, lengths = taml.daily_glucose_windows(
+        df, id, hour=hour, one_per_midnight=one_per_midnight, **grid_options
+    )
+    return window_ids, glucose_histograms(glucose, lengths)
+
+
+def aggregate_histograms(histograms, groups):
+    """
+    Sum histograms per group, e.g. daily histograms into weekly, monthly or per-subject ones.
+
+    Parameters:
+    - histograms: numpy array of shape (n_rows, N_BINS + 1).
+    - groups: array-like of shape (n_rows,), the group label of every row.
+
+    Returns:
+    - keys: numpy array of the sorted unique group labels.
+    - histograms: numpy array of shape (n_groups, N_BINS + 1), int64 counts.
+    """
+    keys, inverse = np.unique(np.asarray(groups), return_inverse=True)
+    summed = np.zeros((len(keys), histograms.shape[1]), dtype=np.int64)
+    np.add.at(summed, inverse.ravel(), histograms)
+    return keys, summed
+
+
+def _order_statistics(cumulative, k):
+    # Value of the k-th smallest sample (0-based) of every histogram
+    return BIN_VALUES[np.minimum((cumulative <= k[:, None]).sum(axis=1), N_BINS - 1)]
+
+
+def histogram_features(histograms, sr=5, features=None):
+    """
+    Compute order-free window features from histograms with per-bin lookup tables.
+
+    Parameters:
+    - histograms: numpy array of shape (n_rows, N_BINS + 1), e.g. from glucose_histograms
+      or aggregate_histograms.
+    - sr: int, the sampling rate in minutes of the underlying grid.
+    - features: list of str, a subset of HISTOGRAM_FEATURE_NAMES (default: all of them).
+
+    Returns:
+    - features: numpy array of shape (n_rows, n_features), columns in the requested order.
+    """
+    features = list(HISTOGRAM_FEATURE_NAMES if features is None else features)
+    unknown = [name for name in features if name not in HISTOGRAM_FEATURE_NAMES]
+    if unknown:
+        raise KeyError(f"not computable from a histogram: {', '.join(unknown)}")
+
+    h = np.atleast_2d(histograms)[:, :N_BINS].astype(float)
+    n = h.sum(axis=1)
+    lengths = n + np.atleast_2d(histograms)[:, MISSING]
+    present = h > 0
+    values = {}
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (h @ BIN_VALUES) / n
+        sd = np.sqrt((h*(BIN_VALUES - mean[:, None])**2).sum(axis=1) / n)
+        values['mean'] = mean
+        values['interdaysd'] = sd
+        values['interdaycv'] = (sd / mean)*100
+        values['J_index'] = 0.001*((mean + sd)**2)
+
+        # Linear percentiles between order statistics, as np.nanpercentile
+        cumulative = h.cumsum(axis=1)
+        has = n > 0
+        for name, q in (('fq', 25), ('median', 50), ('tq', 75)):
+            pos = (q / 100.0)*np.maximum(n - 1, 0)
+            lo = np.floor(pos)
+            t = pos - lo
+            a = _order_statistics(cumulative, lo)
+            b = _order_statistics(cumulative, np.minimum(lo + 1, np.maximum(n - 1, 0)))
+            diff = b - a
+            values[name] = np.where(has, np.where(t >= 0.5, b - diff*(1 - t), a + diff*t), np.nan)
+        values['min'] = np.where(has, BIN_VALUES[np.argmax(present, axis=1)], np.nan)
+        values['max'] = np.where(has, BIN_VALUES[N_BINS - 1 - np.argmax(present[:, ::-1], axis=1)], np.nan)
+
+        # Mean +/- 1 SD band
+        up = (mean + sd)[:, None]
+        dw = (mean - sd)[:, None]
+        in_band = h*((BIN_VALUES <= up) & (BIN_VALUES >= dw))
+        out_band = h*((BIN_VALUES >= up) | (BIN_VALUES <= dw))
+        n_in = in_band.sum(axis=1)
+        n_out = out_band.sum(axis=1)
+        values['TIR'] = n_in*sr
+        values['TOR'] = n_out*sr
+        values['MGN'] = np.where(n_in > 0, (in_band @ BIN_VALUES) / n_in, np.nan)
+        values['MGE'] = np.where(n_out > 0, (out_band @ BIN_VALUES) / n_out, np.nan)
+
+        # Missing slots add zero risk but count towards the mean, as in cgm.LBGI_HBGI
+        values['LBGI'] = (h @ RISK_LOW) / lengths
+        values['HBGI'] = (h @ RISK_HIGH) / lengths
+        values['ADRR'] = np.where(present, RISK_LOW, 0.0).max(axis=1) + np.where(present, RISK_HIGH, 0.0).max(axis=1)
+
+    for name, test in cgm.THRESHOLD_TESTS.items():
+        values[name] = h[:, test(BIN_VALUES)].sum(axis=1)*sr
+    values['GRI'] = cgm.glucose_risk_index(values['TB54'], values['TB70'], values['TA250'], values['TA180'])
+
+    if not features:
+        return np.empty((len(h), 0))
+    return np.column_stack([values[name] for name in features])
+
+
+def histogram_feature_table(histograms, ids, sr=5, features=None):
+    """
+    Feature table with an id column, laid out as CGM_TAML.quantify_glycemic_features_batch.
+
+    Parameters:
+    - histograms: numpy array of shape (n_rows, N_BINS + 1).
+    - ids: array-like of shape (n_rows,), the row ids (window ids or aggregate keys).
+    - sr, features: as for histogram_features.
+
+    Returns:
+    - feature_table: pandas DataFrame with id and the requested features.
+    """
+    feature_names = list(HISTOGRAM_FEATURE_NAMES if features is None else features)
+    feature_table = pd.DataFrame(histogram_features(histograms, sr=sr, features=feature_names),
+                                 columns=feature_names)
+    integer_features = [name for name in feature_names if cgm.FEATURES[name].integer]
+    feature_table[integer_features] = feature_table[integer_features].astype(int)
+    feature_table.insert(0, 'id', np.asarray(ids, dtype=object))
+    return feature_table
@@ -0,0 +1,213 @@
+## Incremental daily glycemic features for CGM readings that arrive over time
+import numpy as np
+import pandas as pd
+
+import CGM_TAML as taml
+import cgmquantify_stuart as cgm
+
+_SLOT = pd.Timedelta(minutes=5).value
+_DAY = pd.Timedelta(days=1).value
+
+class _DayState:
+    """
+    Running state of one subject-day on the 5-minute grid used by the daily windows.
+
+    Slot values are medians of the readings falling in each 5-minute bin. Moments, risk
+    sums and threshold counts are updated by replacing a slot's old contribution with
+    its new one, and peaks are tracked over completed slots with the count_peaks state
+    machine, so an in-order update costs O(new readings). A reading in an already
+    completed slot marks the peak state dirty; it is replayed from the first slot when
+    the live features are next read.
+    """
+
+    def __init__(self, day_start, n_slots):
+        self.day_start = day_start
+        self.values = np.full(n_slots, np.nan)
+        self.readings = {}
+        self.n_readings = 0
+        # Last slot holding any reading, NaN glucose included; the day's window ends there
+        self.last_slot = -1
+        self.n = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.rl = 0.0
+        self.rh = 0.0
+        self.counts = dict.fromkeys(cgm.THRESHOLD_TESTS, 0)
+        # Peak state over slots [0, committed)
+        self.committed = 0
+        self.above = {140: False, 180: False, 200: False}
+        self.peaks = {140: 0, 180: 0, 200: 0}
+        self.peaks_dirty = False
+
+    def _account(self, value, sign):
+        if np.isnan(value):
+            return
+        self.n += sign
+        self.sum += sign*value
+        self.sumsq += sign*value*value
+        low, high = cgm.glucose_risk(value)
+        self.rl += sign*float(low)
+        self.rh += sign*float(high)
+        for name, test in cgm.THRESHOLD_TESTS.items():
+            if test(value):
+                self.counts[name] += sign
+
+    @staticmethod
+    def _step_peaks(values, above, peaks):
+        # The count_peaks state machine over values, updating above and peaks in place
+        for value in values:
+            for threshold in above:
+                if above[threshold]:
+                    if value < threshold:
+                        peaks[threshold] += 1
+                        above[threshold] = False
+                elif value > threshold:
+                    above[threshold] = True
+
+    def _commit(self, end):
+        # Advance the peak state over completed slots
+        self._step_peaks(self.values[self.committed:end], self.above, self.peaks)
+        self.committed = max(self.committed, end)
+
+    def _recount_peaks(self):
+        # Replay the peak state from the first slot after a completed slot changed
+        committed = self.committed
+        self.committed = 0
+        self.above = dict.fromkeys(self.above, False)
+        self.peaks = dict.fromkeys(self.peaks, 0)
+        self._commit(committed)
+        self.peaks_dirty = False
+
+    def add(self, slot, glucose):
+        self.n_readings += 1
+        self.last_slot = max(self.last_slot, slot)
+        if np.isnan(glucose):
+            return
+        readings = self.readings.setdefault(slot, [])
+        readings.append(glucose)
+        old = self.values[slot]
+        new = readings[0] if len(readings) == 1 else float(np.median(readings))
+        self._account(old, -1)
+        self._account(new, +1)
+        self.values[slot] = new
+        if slot < self.committed:
+            self.peaks_dirty = True
+        else:
+            self._commit(slot)
+
+    def live_features(self, sr=5):
+        # Features available from the running accumulators alone
+        if self.n == 0:
+            return {}
+        mean = self.sum / self.n
+        sd = np.sqrt(max(self.sumsq / self.n - mean*mean, 0.0))
+        features = {
+            'mean': mean,
+            'interdaysd': sd,
+            'interdaycv': (sd / mean)*100,
+            'J_index': 0.001*((mean + sd)**2),
+            'LBGI': self.rl / self.n,
+            'HBGI': self.rh / self.n,
+        }
+        features.update({name: count*sr for name, count in self.counts.items()})
+        features['GRI'] = cgm.glucose_risk_index(features['TB54'], features['TB70'], features['TA250'], features['TA180'])
+        if self.peaks_dirty:
+            self._recount_peaks()
+        # Include the slots not yet completed without committing them
+        above, peaks = dict(self.above), dict(self.peaks)
+        self._step_peaks(self.values[self.committed:], above, peaks)
+        for threshold in peaks:
+            features[f'PA{threshold}'] = peaks[threshold] + int(above[threshold])
+        return features
+
+
+class IncrementalFeatureExtractor:
+    """
+    Keep per-subject, per-day state and update daily features as readings arrive.
+
+    Days are calendar days (midnight to midnight) on a 5-minute grid. A day is finished
+    when a reading from a later day arrives for the same subject, or on flush(); finished
+    days with more readings than the coverage threshold (70% of the 5-minute slots, as in
+    feature_extraction_fixed_hour_window_0oclock) are emitted with the full feature set
+    computed by cgm.glycemic_features_batch. Readings for days that are already finished,
+    or that precede the subject's open day, are ignored and counted in late_readings.
+
+    Parameters:
+    - coverage: float, the fraction of 5-minute slots needed to emit a day (default 0.70).
+    - on_day: callable, called with the feature DataFrame of every batch of emitted days.
+    """
+
+    def __init__(self, coverage=0.70, on_day=None):
+        self.n_slots = _DAY // _SLOT
+        self.window_data_threshold = self.n_slots * coverage
+        self.on_day = on_day
+        self.late_readings = 0
+        self._open = {}
+        self._finished_until = {}
+
+    def update(self, id, time, glucose):
+        """
+        Append new readings of one subject.
+
+        Parameters:
+        - id: the subject id.
+        - time: array-like of timestamps (tz-naive), ideally in increasing order.
+        - glucose: array-like of glucose values.
+
+        Returns:
+        - feature_table: pandas DataFrame with id (subject_YYYY-MM-DD) and the features of
+          the days finished by these readings, possibly empty.
+        """
+        time = pd.to_datetime(pd.Series(time)).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        glucose = np.asarray(glucose, dtype=float)
+        finished = []
+        for t, g in zip(time, glucose):
+            day_start = t - t % _DAY
+            state = self._open.get(id)
+            if (day_start < self._finished_until.get(id, np.iinfo(np.int64).min)
+                    or (state is not None and day_start < state.day_start)):
+                self.late_readings += 1
+                continue
+            if state is not None and day_start > state.day_start:
+                finished.append((id, self._open.pop(id)))
+                self._finished_until[id] = day_start
+                state = None
+            if state is None:
+                state = self._open[id] = _DayState(day_start, self.n_slots)
+            state.add(int((t - day_start) // _SLOT), g)
+        return self._emit(finished)
+
+    def flush(self, id=None):
+        """
+        Finish the open day of one subject, or of every subject when id is None.
+
+        Returns:
+        - feature_table: pandas DataFrame of the flushed days that meet the coverage threshold.
+        """
+        ids = list(self._open) if id is None else [id]
+        finished = []
+        for subject in ids:
+            if subject in self._open:
+                state = self._open.pop(subject)
+                self._finished_until[subject] = state.day_start + _DAY
+                finished.append((subject, state))
+        return self._emit(finished)
+
+    def snapshot(self, id):
+        """
+        Live features of a subject's open day from the running accumulators: mean, SD, CV,
+        J_index, LBGI/HBGI over observed slots, threshold times, GRI and peak counts.
+        Returns an empty dict if the subject has no open day.
+        """
+        state = self._open.get(id)
+        return {} if state is None else state.live_features()
+
+    def _emit(self, finished):
+        rows = [(id, state) for id, state in finished if state.n_readings > self.window_data_threshold]
+        window_ids = [f"{id}_{pd.Timestamp(state.day_start).date()}" for id, state in rows]
+        glucose = np.array([state.values for _, state in rows]).reshape(len(rows), self.n_slots)
+        lengths = np.array([state.last_slot + 1 for _, state in rows], dtype=int)
+        feature_table = taml.quantify_glycemic_features_batch(glucose, window_ids, lengths)
+        if self.on_day is not None and len(feature_table):
+            self.on_day(feature_table)
+        return feature_table
@@ -0,0 +1,146 @@
+## Multi-scale sliding windows over a subject's regularized 5-minute series
+import numpy as np
+import pandas as pd
+
+import CGM_TAML as taml
+import cgmquantify_stuart as cgm
+
+# Features computed from prefix sums in O(1) per window
+PREFIX_FEATURE_NAMES = [
+    "mean", "interdaysd", "interdaycv", "J_index", "LBGI", "HBGI", "TA140", "TA180", "TA200",
+    "TA250", "TB70", "TB54", "TIR_70_180", "TITR", "GRI"
+]
+
+def _prefix(x):
+    # Cumulative sum with a leading zero, so sum(x[s:e]) == P[e] - P[s]
+    out = np.zeros(len(x) + 1)
+    np.cumsum(x, out=out[1:])
+    return out
+
+
+def window_starts(grid_start, n_grid, length, stride, sr=5):
+    """
+    Grid positions of every window of length slots that fits in the grid and starts on a
+    multiple of stride minutes (in epoch time, e.g. on the hour for stride=60).
+
+    Returns:
+    - starts: numpy array of int grid positions.
+    """
+    if stride % sr:
+        raise ValueError(f"stride must be a multiple of {sr} minutes, got {stride}")
+    grid_minute = int(grid_start.astype('datetime64[m]').astype(np.int64))
+    first = ((-grid_minute) % stride) // sr
+    return np.arange(first, n_grid - length + 1, stride // sr)
+
+
+def prefix_window_features(values, starts, length, sr=5):
+    """
+    Features of many windows of one length from prefix sums over a regularized series.
+
+    Sums, sums of squares (of values centered on the series mean, to limit cancellation),
+    risk sums and threshold counts are accumulated once; every window then costs O(1).
+    LBGI and HBGI divide by the window length, so missing slots count as zero risk.
+
+    Parameters:
+    - values: numpy array, the regularized glucose series, NaN for missing slots.
+    - starts: numpy array of int, the first slot of every window.
+    - length: int, the window length in slots.
+    - sr: int, the slot length in minutes.
+
+    Returns:
+    - features: dict mapping coverage and PREFIX_FEATURE_NAMES to arrays of shape (n_windows,).
+    """
+    valid = ~np.isnan(values)
+    g = np.where(valid, values, 0.0)
+    center = g[valid].mean() if valid.any() else 0.0
+    centered = np.where(valid, values - center, 0.0)
+    ends = starts + length
+
+    def window_sum(x):
+        prefix = _prefix(x)
+        return prefix[ends] - prefix[starts]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        risk_low, risk_high = cgm.glucose_risk(values)
+        n = window_sum(valid)
+        shifted_mean = window_sum(centered) / n
+        mean = shifted_mean + center
+        sd = np.sqrt(np.maximum(window_sum(centered**2) / n - shifted_mean**2, 0.0))
+        features = {
+            'coverage': n / length,
+            'mean': mean,
+            'interdaysd': sd,
+            'interdaycv': (sd / mean)*100,
+            'J_index': 0.001*((mean + sd)**2),
+            'LBGI': window_sum(risk_low) / length,
+            'HBGI': window_sum(risk_high) / length,
+        }
+        for name, test in cgm.THRESHOLD_TESTS.items():
+            features[name] = window_sum(test(values))*sr
+    features['GRI'] = cgm.glucose_risk_index(features['TB54'], features['TB70'], features['TA250'], features['TA180'])
+    return features
+
+
+def multiscale_window_features(df, id, hours=(6, 12, 24, 72), stride=60, coverage=0.70, features=None,
+                               chunk_size=4096, fill='none', max_gap=None):
+    """
+    Features of every window of every requested length and stride for one subject.
+
+    The subject is regularized onto the 5-minute grid once (see CGM_TAML.regularize_glucose).
+    PREFIX_FEATURE_NAMES come from prefix sums in O(N) per window length; other registered
+    features (quantiles, min/max, the SD band, ADRR, peaks) fall back to
+    cgm.glycemic_features_batch on sliding-window views, chunk_size windows at a time.
+
+    Parameters:
+    - df: pandas DataFrame with Glucose and Time columns for one subject.
+    - id: the subject id.
+    - hours: sequence of window lengths in hours.
+    - stride: int, minutes between window starts; starts are aligned to multiples of stride.
+    - coverage: float, the minimum fraction of non-missing slots to keep a window.
+    - features: list of str, registered feature names (default: PREFIX_FEATURE_NAMES).
+    - chunk_size: int, windows per sliding-window batch for fallback features.
+    - fill, max_gap: gap filling on the grid, see CGM_TAML.regularize_glucose.
+
+    Returns:
+    - feature_table: pandas DataFrame with id, hour, start, coverage and the requested
+      features, one row per kept window, ordered by hour and start.
+    """
+    features = list(PREFIX_FEATURE_NAMES if features is None else features)
+    fallback = [name for name in features if name not in PREFIX_FEATURE_NAMES]
+    cgm.required_nodes(fallback)
+    columns = ['id', 'hour', 'start', 'coverage'] + features
+
+    df = df.sort_values(by='Time').reset_index(drop=True)
+    grid_start, values, _ = taml.regularize_glucose(df, fill=fill, max_gap=max_gap)
+    sr = 5
+    tables = []
+    for hour in hours:
+        length = int(hour*60 // sr)
+        if len(values) < length:
+            continue
+        starts = window_starts(grid_start, len(values), length, stride, sr=sr)
+        window_values = prefix_window_features(values, starts, length, sr=sr)
+        keep = window_values['coverage'] >= coverage
+        starts = starts[keep]
+        table = pd.DataFrame({name: window_values[name][keep] for name in ['coverage'] + features
+                              if name in window_values})
+
+        if fallback and len(starts):
+            views = np.lib.stride_tricks.sliding_window_view(values, length)
+            rows = [cgm.glycemic_features_batch(views[starts[i:i + chunk_size]], sr=sr, features=fallback)
+                    for i in range(0, len(starts), chunk_size)]
+            table[fallback] = np.vstack(rows)
+        elif fallback:
+            table[fallback] = np.empty((0, len(fallback)))
+
+        table.insert(0, 'id', id)
+        table.insert(1, 'hour', hour)
+        table.insert(2, 'start', grid_start + starts*np.timedelta64(sr, 'm'))
+        tables.append(table)
+
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    feature_table = pd.concat(tables, ignore_index=True)[columns]
+    integer_features = [name for name in features if cgm.FEATURES[name].integer]
+    feature_table[integer_features] = feature_table[integer_features].astype(int)
+    return feature_table
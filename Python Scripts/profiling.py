@@ -0,0 +1,95 @@
+## Optional per-stage profiling of the extraction pipeline
+import time
+from contextlib import nullcontext
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler:
+    """
+    Collect cumulative wall time and call counts per stage, plus event counters.
+
+    Pass an instance as profiler= to the extraction functions; use stage(name) as a
+    context manager around timed code and count(name, n) for counters. Reports are
+    plain dicts, so worker processes can return them and the parent can merge them.
+
+    Parameters:
+    - callback: callable, called as callback(kind, name, value) for every stage exit
+      (kind 'stage', value in seconds) and counter update (kind 'count').
+    """
+
+    enabled = True
+
+    def __init__(self, callback=None):
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+        self.callback = callback
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add_time(self, name, seconds, calls=1):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+        if self.callback is not None:
+            self.callback('stage', name, seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+        if self.callback is not None:
+            self.callback('count', name, n)
+
+    def report(self):
+        """
+        Returns:
+        - report: dict with 'stages' ({name: {'seconds', 'calls'}}, slowest first) and 'counters'.
+        """
+        stages = sorted(self.seconds, key=self.seconds.get, reverse=True)
+        return {
+            'stages': {name: {'seconds': self.seconds[name], 'calls': self.calls[name]} for name in stages},
+            'counters': dict(self.counters),
+        }
+
+    def merge(self, report):
+        """
+        Add a report (e.g. from a worker process) into this profiler.
+        """
+        for name, stage in report['stages'].items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + stage['seconds']
+            self.calls[name] = self.calls.get(name, 0) + stage['calls']
+        for name, n in report['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        return self
+
+
+class _NullProfiler:
+    """
+    Stand-in used when profiling is disabled: every hook is a no-op.
+    """
+
+    enabled = False
+    _context = nullcontext()
+
+    def stage(self, name):
+        return self._context
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_PROFILER = _NullProfiler()
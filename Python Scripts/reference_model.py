@@ -0,0 +1,175 @@
+## Persisted UMAP reference map for scoring new subject-days
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+import umap
+from sklearn.preprocessing import StandardScaler
+
+import CGM_TAML as taml
+import cgmquantify_stuart as cgm
+from calculate_scores import SilhouetteScorer
+
+
+class ReferenceModel:
+    """
+    Everything needed to place new subject-days on a fitted reference map: the feature
+    scaling, the fitted UMAP projection, the reference embedding and labels, and a
+    SilhouetteScorer index over the reference embedding.
+
+    Build it with ReferenceModel.fit, persist it with save and reload it with
+    ReferenceModel.load; scoring never refits UMAP.
+
+    Parameters:
+    - scaler: fitted sklearn StandardScaler.
+    - reducer: fitted umap.UMAP.
+    - embedding: numpy array of shape (n_samples, n_components), the reference embedding.
+    - labels: numpy array of shape (n_samples,), the reference labels.
+    - feature_names: list of str, the feature columns used, in order.
+    - hour: int, the window length used for raw CGM data.
+    - one_per_midnight: bool, the anchor mode used for raw CGM data.
+    """
+
+    def __init__(self, scaler, reducer, embedding, labels, feature_names, hour=24, one_per_midnight=False):
+        self.scaler = scaler
+        self.reducer = reducer
+        self.embedding = np.asarray(embedding)
+        self.labels = np.asarray(labels)
+        self.feature_names = list(feature_names)
+        self.hour = hour
+        self.one_per_midnight = one_per_midnight
+        self.scorer = SilhouetteScorer(self.embedding, self.labels)
+
+    @classmethod
+    def fit(cls, feature_table, labels, feature_names=None, hour=24, one_per_midnight=False, **umap_kwargs):
+        """
+        Fit the scaling and the UMAP projection on a reference feature table.
+
+        Parameters:
+        - feature_table: pandas DataFrame of window features, e.g. from
+          feature_extraction_fixed_hour_window_0oclock; rows with missing features are dropped.
+        - labels: array-like of shape (n_rows,), the reference label of each row.
+        - feature_names: list of str, the feature columns (default: cgm.GLYCEMIC_FEATURE_NAMES).
+        - hour, one_per_midnight: the window settings used when scoring raw CGM data.
+        - **umap_kwargs: passed to umap.UMAP (e.g. n_neighbors, min_dist, random_state).
+
+        Returns:
+        - model: ReferenceModel.
+        """
+        feature_names = list(feature_names or cgm.GLYCEMIC_FEATURE_NAMES)
+        features = feature_table[feature_names]
+        complete = features.notna().all(axis=1).to_numpy()
+        features = features.to_numpy(dtype=float)[complete]
+        labels = np.asarray(labels)[complete]
+
+        scaler = StandardScaler().fit(features)
+        reducer = umap.UMAP(**umap_kwargs)
+        embedding = reducer.fit_transform(scaler.transform(features))
+        return cls(scaler, reducer, embedding, labels, feature_names, hour=hour, one_per_midnight=one_per_midnight)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def transform(self, feature_table):
+        """
+        Project feature rows onto the reference map.
+
+        Returns:
+        - embedding: numpy array of shape (n_rows, n_components).
+        """
+        features = feature_table[self.feature_names].to_numpy(dtype=float)
+        return self.reducer.transform(self.scaler.transform(features))
+
+    def score_features(self, feature_table, labels, method='mean_other'):
+        """
+        Project feature rows and score them against the reference embedding.
+
+        Parameters:
+        - feature_table: pandas DataFrame with an id column and the model's feature columns;
+          rows with missing features are dropped.
+        - labels: scalar or array-like, the label of the new rows.
+        - method: 'mean_other' or 'nearest', see SilhouetteScorer.score.
+
+        Returns:
+        - scores: pandas DataFrame with id, one column per embedding component (umap_1, ...)
+          and silhouette.
+        """
+        complete = feature_table[self.feature_names].notna().all(axis=1).to_numpy()
+        feature_table = feature_table[complete]
+        labels = np.broadcast_to(np.asarray(labels), (len(complete),))[complete]
+        embedding = self.transform(feature_table) if len(feature_table) else np.zeros((0, self.embedding.shape[1]))
+
+        scores = pd.DataFrame(embedding, columns=[f"umap_{i + 1}" for i in range(embedding.shape[1])])
+        scores.insert(0, 'id', feature_table['id'].to_numpy() if 'id' in feature_table else np.arange(len(scores)))
+        scores['silhouette'] = self.scorer.score(embedding, labels, method=method) if len(scores) else []
+        return scores
+
+    def score_raw(self, df, id, label, method='mean_other'):
+        """
+        Window extraction, featurization, projection and silhouette scoring of raw CGM data
+        in one call.
+
+        Parameters:
+        - df: pandas DataFrame with Glucose and Time columns for one subject.
+        - id: the subject id.
+        - label: the subject's label.
+        - method: 'mean_other' or 'nearest', see SilhouetteScorer.score.
+
+        Returns:
+        - scores: pandas DataFrame as returned by score_features, one row per qualifying day.
+        """
+        feature_table = taml.feature_extraction_fixed_hour_window_0oclock(
+            df, id, hour=self.hour, one_per_midnight=self.one_per_midnight
+        )
+        return self.score_features(feature_table, label, method=method)
+
+
+def benchmark_latency(model, df, id, label, batch_sizes=(1, 16, 128), repeats=20):
+    """
+    Measure scoring latency of a reference model.
+
+    Parameters:
+    - model: ReferenceModel.
+    - df: pandas DataFrame with Glucose and Time columns for one subject with at least one
+      qualifying day.
+    - id, label: the subject id and label.
+    - batch_sizes: sizes of batched feature requests to time.
+    - repeats: timed repetitions per measurement.
+
+    Returns:
+    - results: dict mapping 'raw_day' and 'batch_<n>' to the median latency in milliseconds;
+      raw_day times score_raw on the subject's first qualifying day, batch_<n> times
+      score_features on n feature rows.
+    """
+    def median_ms(call):
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - start) * 1000)
+        return float(np.median(timings))
+
+    feature_table = taml.feature_extraction_fixed_hour_window_0oclock(
+        df, id, hour=model.hour, one_per_midnight=True
+    ).dropna()
+    if feature_table.empty:
+        raise ValueError(f"subject {id!r} has no qualifying day to benchmark")
+
+    # Raw data of the first qualifying day only; window numbers count midnight anchors from 1
+    df = df.sort_values(by='Time').reset_index(drop=True)
+    window_number = int(feature_table['id'].iloc[0].rsplit('_win', 1)[1])
+    start_time = df.Time.iloc[taml.midnight_anchor_index(df, one_per_midnight=True)[window_number - 1]]
+    day = df[(df.Time >= start_time) & (df.Time < start_time + pd.Timedelta(hours=model.hour))]
+
+    results = {'raw_day': median_ms(lambda: model.score_raw(day, id, label))}
+    for batch_size in batch_sizes:
+        batch = feature_table.iloc[np.arange(batch_size) % len(feature_table)]
+        results[f'batch_{batch_size}'] = median_ms(lambda: model.score_features(batch, label))
+    return results
@@ -0,0 +1,72 @@
+## Seeded synthetic CGM data in the id/gl/time layout described in the README
+import numpy as np
+import pandas as pd
+
+
+def generate_cgm(n_subjects=100, n_days=14, sampling_minutes=5, gap_rate=0.5, excursion_rate=2.0,
+                 start='2020-01-01', seed=0):
+    """
+    Generate synthetic CGM traces for benchmarking.
+
+    Each subject gets a baseline glucose level, a circadian component, meal responses,
+    random noise, hypo- and hyperglycemic excursions and sensor gaps. Values are integer
+    mg/dL clipped to the 39-401 sensor range. Rows are sorted by time and grouped by id.
+
+    Parameters:
+    - n_subjects: int, the number of subjects.
+    - n_days: int, the number of days per subject.
+    - sampling_minutes: int, the sampling interval (e.g. 1, 5 or 15 minutes).
+    - gap_rate: float, the expected number of sensor gaps per subject-day (gaps last 15 min to 6 h).
+    - excursion_rate: float, the expected number of hypo/hyper excursions per subject-day.
+    - start: str, the first day.
+    - seed: int, the random seed.
+
+    Returns:
+    - df: pandas DataFrame with id (str), gl (float) and time (datetime64) columns.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(n_days * 24 * 60 / sampling_minutes)
+    minutes = np.arange(n) * sampling_minutes
+    start = pd.Timestamp(start)
+    frames = []
+
+    for subject in range(n_subjects):
+        baseline = rng.normal(130, 25)
+        variability = rng.uniform(0.5, 2.0)
+        glucose = baseline + 15 * np.sin(2 * np.pi * (minutes / 1440 - 0.25))
+
+        # Meal responses: three meals a day with jittered times and sizes
+        for day in range(n_days):
+            for meal_time in (8 * 60, 13 * 60, 19 * 60):
+                onset = day * 1440 + meal_time + rng.normal(0, 45)
+                size = rng.gamma(2.0, 20) * variability
+                after = np.clip(minutes - onset, 0, None)
+                glucose += size * (after / 45) * np.exp(1 - after / 45)
+
+        # Hypo- and hyperglycemic excursions
+        for _ in range(rng.poisson(excursion_rate * n_days)):
+            center = rng.uniform(0, n_days * 1440)
+            depth = rng.choice([-1, 1]) * rng.uniform(40, 150)
+            width = rng.uniform(20, 120)
+            glucose += depth * np.exp(-0.5 * ((minutes - center) / width) ** 2)
+
+        glucose += rng.normal(0, 5 * variability, n)
+        glucose = np.clip(np.round(glucose), 39, 401)
+
+        # Sensor gaps
+        keep = np.ones(n, dtype=bool)
+        for _ in range(rng.poisson(gap_rate * n_days)):
+            gap_start = rng.integers(0, n)
+            keep[gap_start:gap_start + int(rng.uniform(15, 360) / sampling_minutes)] = False
+
+        # Readings drift by up to half a minute around the nominal sampling time
+        jitter = rng.uniform(-1, 1, n) * min(30, sampling_minutes * 60 * 0.4)
+        offset = pd.Timedelta(seconds=float(rng.uniform(0, sampling_minutes * 60)))
+        time = start + offset + pd.to_timedelta(minutes * 60 + jitter, unit='s')
+        frames.append(pd.DataFrame({
+            'id': f"synthetic_{subject}",
+            'gl': glucose[keep],
+            'time': time[keep].floor('s'),
+        }))
+
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,32 @@
+## Regression checks for incremental_features on out-of-order input
+import numpy as np
+import pandas as pd
+
+import cgmquantify_stuart as cgm
+from incremental_features import IncrementalFeatureExtractor
+
+PEAK_FEATURES = ['PA140', 'PA180', 'PA200']
+
+
+def test_earlier_day_reading_is_late_while_later_day_is_open():
+    extractor = IncrementalFeatureExtractor()
+    extractor.update('S', ['2023-01-02 00:00'], [100.0])
+    extractor.update('S', ['2023-01-01 00:05'], [300.0])
+    assert extractor.late_readings == 1
+    assert extractor.snapshot('S')['mean'] == 100.0
+
+
+def test_snapshot_peaks_after_reading_in_completed_slot():
+    times = pd.date_range('2023-01-01 00:00', periods=12, freq='5min')
+    glucose = [100, 150, 190, 210, 120, 100, 150, 100, 100, 190, 210, 215]
+    extractor = IncrementalFeatureExtractor()
+    extractor.update('S', times, glucose)
+    # Pull the first peak above 200 back under the threshold
+    extractor.update('S', [times[3]], [170.0])
+
+    values = np.array(glucose, dtype=float)
+    values[3] = np.median([210.0, 170.0])
+    expected = cgm.glycemic_features_batch(values[None, :], features=PEAK_FEATURES)[0]
+    snapshot = extractor.snapshot('S')
+    # The last, still open slot counts too
+    assert [snapshot[name] for name in PEAK_FEATURES] == list(expected)
@@ -0,0 +1,123 @@
+## UMAP hyperparameter sweep over a process pool, sharing one nearest-neighbor graph
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import umap
+from sklearn.preprocessing import StandardScaler
+from umap.umap_ import nearest_neighbors
+
+import cgmquantify_stuart as cgm
+from calculate_scores import SilhouetteScorer, dunn_index
+
+_WORKER_DATA = None
+
+
+def _init_sweep_worker(data):
+    # Process pool initializer: ship the scaled features, kNN graph and labels once
+    global _WORKER_DATA
+    _WORKER_DATA = data
+
+
+def _fit_and_score(params):
+    n_neighbors, min_dist = params
+    data = _WORKER_DATA
+    start = time.perf_counter()
+    reducer = umap.UMAP(
+        n_neighbors=n_neighbors, min_dist=min_dist,
+        # No search index is shipped to the workers, so the fitted reducers cannot transform new data
+        precomputed_knn=(data['knn_indices'][:, :n_neighbors], data['knn_dists'][:, :n_neighbors], None),
+        **data['umap_kwargs'],
+    )
+    embedding = reducer.fit_transform(data['X'])
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    labels = data['labels']
+    scored = data['scored']
+    silhouette = SilhouetteScorer(embedding, labels).score(embedding[scored], labels[scored], method=data['method'])
+    result = {
+        'n_neighbors': n_neighbors,
+        'min_dist': min_dist,
+        'dunn_index': dunn_index(embedding, labels),
+        'silhouette': float(np.mean(silhouette)),
+        'fit_seconds': fit_seconds,
+        'score_seconds': time.perf_counter() - start,
+    }
+    return result
+
+
+def umap_sweep(feature_table, labels, n_neighbors=(5, 15, 30, 50), min_dist=(0.0, 0.1, 0.25, 0.5),
+               feature_names=None, n_scored=2000, method='mean_other', n_workers=None, random_state=0, verbose=False,
+               **umap_kwargs):
+    """
+    Fit and score a grid of UMAP settings on one feature table.
+
+    Features are standardized once and the nearest-neighbor graph is built once at the
+    largest n_neighbors; every setting fits UMAP on the first n_neighbors columns of that
+    graph, so only the layout optimization is repeated. Settings run across a process pool
+    and each embedding is scored with calculate_scores.dunn_index and the mean
+    SilhouetteScorer score of n_scored seeded sample points.
+
+    Parameters:
+    - feature_table: pandas DataFrame of window features; rows with missing features are dropped.
+    - labels: array-like of shape (n_rows,), the label of each row.
+    - n_neighbors: sequence of int, the n_neighbors values.
+    - min_dist: sequence of float, the min_dist values.
+    - feature_names: list of str, the feature columns (default: cgm.GLYCEMIC_FEATURE_NAMES).
+    - n_scored: int, the number of points whose silhouette scores are averaged.
+    - method: 'mean_other' or 'nearest', see SilhouetteScorer.score.
+    - n_workers: int, the number of spawned worker processes (default: os.cpu_count()); 1 runs
+      in-process. Scripts calling the sweep need an `if __name__ == '__main__':` guard.
+    - random_state: int, the seed of the kNN search, the UMAP layouts and the scored sample.
+    - verbose: bool, print the kNN and sweep timings.
+    - **umap_kwargs: other umap.UMAP parameters (e.g. n_components, metric is euclidean).
+
+    Returns:
+    - results: pandas DataFrame with n_neighbors, min_dist, dunn_index, silhouette,
+      fit_seconds and score_seconds, one row per setting, best silhouette first.
+    """
+    feature_names = list(feature_names or cgm.GLYCEMIC_FEATURE_NAMES)
+    features = feature_table[feature_names]
+    complete = features.notna().all(axis=1).to_numpy()
+    X = StandardScaler().fit_transform(features.to_numpy(dtype=float)[complete])
+    labels = np.asarray(labels)[complete]
+    n_workers = n_workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    knn_indices, knn_dists, _ = nearest_neighbors(
+        X, n_neighbors=max(n_neighbors), metric='euclidean', metric_kwds={}, angular=False,
+        random_state=np.random.RandomState(random_state),
+    )
+    knn_seconds = time.perf_counter() - start
+
+    data = {
+        'X': X,
+        'labels': labels,
+        'knn_indices': knn_indices,
+        'knn_dists': knn_dists,
+        'scored': np.random.default_rng(random_state).choice(len(X), size=min(n_scored, len(X)), replace=False),
+        'method': method,
+        'umap_kwargs': dict(umap_kwargs, random_state=random_state),
+    }
+    grid = list(itertools.product(n_neighbors, min_dist))
+    start = time.perf_counter()
+    if n_workers == 1:
+        _init_sweep_worker(data)
+        rows = [_fit_and_score(params) for params in grid]
+    else:
+        # Spawned workers: numba's thread pool in a UMAP-using parent does not survive a fork
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=context, initializer=_init_sweep_worker,
+                                 initargs=(data,)) as executor:
+            rows = list(executor.map(_fit_and_score, grid))
+    if verbose:
+        print(f"kNN graph ({len(X)} points, k={max(n_neighbors)}) in {knn_seconds:.1f}s, "
+              f"{len(grid)} settings in {time.perf_counter() - start:.1f}s ({n_workers} workers)")
+
+    results = pd.DataFrame(rows)
+    return results.sort_values('silhouette', ascending=False, kind='stable').reset_index(drop=True)